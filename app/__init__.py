@@ -5,6 +5,9 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_mail import Mail
+from redis import Redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 
 
 app = Flask(__name__)
@@ -15,6 +18,10 @@ cors = CORS(app)
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 mail = Mail(app)
+redis = Redis.from_url(app.config['REDIS_URL'],
+                       socket_connect_timeout=app.config['REDIS_CONNECT_TIMEOUT'],
+                       socket_timeout=app.config['REDIS_TIMEOUT'],
+                       retry=Retry(NoBackoff(), 0))
 
 from app import routes, models, errors, api, util
 app.register_blueprint(api.api_bp)
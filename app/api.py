@@ -1,8 +1,17 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, g, has_request_context, abort
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from app import app, db
-from app.models import Hall, Manager, Meal, Item, Nutrition
-from app.util import to_json
+from app.models import Hall, Manager, Meal, Item, Nutrition, Menu
+from app.util import DATE_FMT, TIMEZONE, to_json, fetch_rows, stream_rows
+from app.pagination import wants_page, paginate
+from app.generations import conditional
+from app.cache import cached
+from app.compression import compress_response, make_stored_response
+from app.occupancy import RESOLUTIONS, MAX_DAYS, get_occupancy_history
+from app.events import hub, stream_hall_changes
 
 import os
 import datetime
@@ -19,31 +28,116 @@ STATUS = to_json({
 })
 
 
+@api_bp.before_request
+def reset_query_count():
+    g.query_count = 0
+
+
+@api_bp.teardown_request
+def check_query_count(exc):
+    # Catch accidental eager loading or N+1 queries. Streamed responses only tear down once their body has
+    # been sent, so queries issued while streaming it are counted too.
+    max_queries = app.config['MAX_QUERIES_PER_REQUEST']
+    query_count = g.get('query_count', 0)
+    if query_count > max_queries:
+        message = '%s issued %d SQL queries, more than the allowed %d.' % (request.path, query_count, max_queries)
+        if app.testing:
+            raise AssertionError(message)
+        app.logger.warning(message)
+
+
+@api_bp.after_request
+def compress(response):
+    return compress_response(response)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+
 @api_bp.route('/status')
 def api_status():
     return STATUS
 
 
 @api_bp.route('/halls')
+@conditional('halls')
+@cached('halls', timeout=5 * 60)
 def api_halls():
     halls = Hall.query.order_by(Hall.nickname).all()
     return to_json(halls)
 
 
+@api_bp.route('/halls/stream')
+def api_halls_stream():
+    try:
+        changes = hub.subscribe()
+    except RedisError as e:
+        app.logger.warning('Could not subscribe to hall changes: %s', e)
+        abort(503)
+    # Read after subscribing, so that changes made in between still reach the client
+    halls = Hall.query.order_by(Hall.nickname).all()
+    response = Response(stream_hall_changes(changes, to_json(halls)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep proxies such as nginx from holding events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api_bp.route('/halls/<hall_id>')
+@conditional('halls')
+@cached('halls', timeout=5 * 60)
 def api_hall(hall_id):
     hall = Hall.query.get_or_404(hall_id)
     return to_json(hall)
 
 
 @api_bp.route('/halls/<hall_id>/managers')
+@conditional('managers')
+@cached('managers')
 def api_hall_managers(hall_id):
     hall = Hall.query.get_or_404(hall_id)
     managers = hall.managers
     return to_json(managers)
 
 
+@api_bp.route('/halls/<hall_id>/occupancy')
+@conditional('occupancy')
+@cached('occupancy', timeout=5 * 60)
+def api_hall_occupancy(hall_id):
+    Hall.query.get_or_404(hall_id)
+
+    resolution = request.args.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS:
+        abort(400)
+    today = datetime.datetime.now(TIMEZONE).date()
+    try:
+        start_date = datetime.datetime.strptime(request.args['start'], DATE_FMT).date() if 'start' in request.args else today
+        end_date = datetime.datetime.strptime(request.args['end'], DATE_FMT).date() if 'end' in request.args else today
+    except ValueError:
+        abort(400)
+    if (end_date - start_date).days + 1 > MAX_DAYS[resolution]:
+        abort(400)
+
+    history = get_occupancy_history(hall_id, start_date, end_date, resolution)
+    return to_json(history)
+
+
+def fetch_meals(hall_id=None, date=None, start_date=None, end_date=None):
+    meals = Meal.search_query(hall_id=hall_id,
+                              date=date,
+                              start_date=start_date,
+                              end_date=end_date)
+    if wants_page():
+        return paginate(meals, Meal)
+    return fetch_rows(meals, Meal), {}
+
+
 @api_bp.route('/halls/<hall_id>/meals')
+@conditional('meals')
+@cached('meals')
 def api_hall_meals(hall_id):
     hall = Hall.query.get_or_404(hall_id)
 
@@ -51,66 +145,121 @@ def api_hall_meals(hall_id):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    meals = Meal.search(hall_id=hall_id,
-                        date=date,
-                        start_date=start_date,
-                        end_date=end_date)
+    meals, headers = fetch_meals(hall_id=hall_id,
+                                 date=date,
+                                 start_date=start_date,
+                                 end_date=end_date)
 
     if not meals:
         fallback_hall_id = app.config['FALLBACK_HALL_ID']
         if fallback_hall_id:
-            meals = Meal.search(fallback_hall_id,
-                                date=date,
-                                start_date=start_date,
-                                end_date=end_date)
+            meals, headers = fetch_meals(fallback_hall_id,
+                                         date=date,
+                                         start_date=start_date,
+                                         end_date=end_date)
+
+    return to_json(meals), headers
+
+
+def get_menu_date():
+    date = request.args.get('date')
+    if date is None:
+        return datetime.datetime.now(TIMEZONE).date()
+    try:
+        return datetime.datetime.strptime(date, DATE_FMT).date()
+    except ValueError:
+        abort(400)
+
 
-    return to_json(meals)
+def get_implicit_menu_date(hall_id):
+    # Without a date, the menu served changes at local midnight even if the meals don't
+    if 'date' in request.args:
+        return None
+    return get_menu_date()
+
+
+@api_bp.route('/halls/<hall_id>/menu')
+@conditional('meals', day=get_implicit_menu_date)
+def api_hall_menu(hall_id):
+    date = get_menu_date()
+
+    # Menus are serialized at scrape time, so this is a single primary key lookup
+    menu = Menu.query.get((hall_id, date))
+    if menu is None:
+        fallback_hall_id = app.config['FALLBACK_HALL_ID']
+        if fallback_hall_id:
+            menu = Menu.query.get((fallback_hall_id, date))
+    if menu is None:
+        abort(404)
+    return make_stored_response(menu.body, {'gzip': menu.body_gzip, 'br': menu.body_br}, 'application/json')
 
 
 @api_bp.route('/managers')
+@conditional('managers')
+@cached('managers')
 def api_managers():
-    managers = Manager.query.all()
+    if wants_page():
+        managers, headers = paginate(Manager.query, Manager)
+        return to_json(managers), headers
+    managers = fetch_rows(Manager.query, Manager)
     return to_json(managers)
 
 
 @api_bp.route('/meals')
+@conditional('meals')
+@cached('meals')
 def api_meals():
     date = request.args.get('date')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    meals = Meal.search(date=date,
-                        start_date=start_date,
-                        end_date=end_date)
-    return to_json(meals)
+    if date is None and start_date is None and end_date is None and not wants_page():
+        # Unbounded, so stream the whole history rather than building it in memory
+        return stream_rows(Meal.search_query(), Meal)
+    meals, headers = fetch_meals(date=date,
+                                 start_date=start_date,
+                                 end_date=end_date)
+    return to_json(meals), headers
 
 
 @api_bp.route('/meals/<meal_id>')
+@conditional('meals')
+@cached('meals')
 def api_meal(meal_id):
     meal = Meal.query.get_or_404(meal_id)
     return to_json(meal)
 
 
 @api_bp.route('/meals/<meal_id>/items')
+@conditional('items')
+@cached('items')
 def api_meal_items(meal_id):
-    meal = Meal.query.get_or_404(meal_id)
+    meal = Meal.query.options(db.selectinload(Meal.items)).get_or_404(meal_id)
     items = meal.items
     return to_json(items)
 
 
 @api_bp.route('/items')
+@conditional('items')
+@cached('items')
 def api_items():
-    items = Item.query.all()
-    return to_json(items)
+    if wants_page():
+        items, headers = paginate(Item.query, Item)
+        return to_json(items), headers
+    return stream_rows(Item.query.order_by(Item.id), Item)
 
 
 @api_bp.route('/items/<item_id>')
+@conditional('items')
+@cached('items')
 def api_item(item_id):
     item = Item.query.get_or_404(item_id)
     return to_json(item)
 
 
 @api_bp.route('/items/<item_id>/nutrition')
+@conditional('items')
+@cached('items')
 def api_item_nutrition(item_id):
     item = Item.query.get_or_404(item_id)
     nutrition = item.nutrition
@@ -0,0 +1,115 @@
+from flask import request, make_response
+from functools import wraps
+from redis.exceptions import RedisError, WatchError
+
+from app import app, redis
+from app.generations import GENERATIONS_KEY, CACHE_KEYS_FMT
+from app.compression import ENCODINGS, compress_all, make_stored_response
+
+import time
+import uuid
+from urllib.parse import urlencode
+
+# How long the worker filling a cache entry may take before others stop waiting for it
+FILL_TIMEOUT = 10
+FILL_POLL_INTERVAL = 0.05
+
+
+def cache_key(family):
+    generation = int(redis.hget(GENERATIONS_KEY, family) or 0)
+    # Normalize so that argument order, and the prefix the blueprint is mounted under, don't matter
+    view_args = urlencode(sorted((request.view_args or {}).items()))
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return 'cache:%s:%d:%s:%s?%s' % (family, generation, request.endpoint, view_args, args)
+
+
+def to_entry(response):
+    body = response.get_data()
+    # Compress once now rather than on every hit
+    variants = compress_all(body)
+    return {
+        b'body': body,
+        b'mimetype': response.mimetype.encode(),
+        b'link': response.headers.get('Link', '').encode(),
+        **{encoding.encode(): variant for encoding, variant in variants.items()},
+    }
+
+
+def from_entry(entry):
+    variants = {encoding: entry.get(encoding.encode()) for encoding in ENCODINGS}
+    response = make_stored_response(entry[b'body'], variants, entry[b'mimetype'].decode())
+    if entry[b'link']:
+        response.headers['Link'] = entry[b'link'].decode()
+    return response
+
+
+def release(lock, token):
+    """
+    Delete a fill lock only if it's still the one taken with this token.
+    A fill running past FILL_TIMEOUT loses its lock, which another worker may have taken since.
+    """
+    with redis.pipeline() as pipeline:
+        try:
+            pipeline.watch(lock)
+            if pipeline.get(lock) == token:
+                pipeline.multi()
+                pipeline.delete(lock)
+                pipeline.execute()
+        except WatchError:
+            # Changed hands while checking, so it's no longer ours
+            pass
+
+
+def fill(key, family, timeout, render):
+    """
+    Render and store a response, making sure only one worker does so at a time.
+    Other workers missing on the same key wait for the entry instead of repeating the same queries.
+    """
+    lock = key + ':lock'
+    token = uuid.uuid4().hex.encode()
+    if redis.set(lock, token, nx=True, ex=FILL_TIMEOUT):
+        try:
+            response = make_response(render())
+            # Streamed responses are unbounded, so they're never buffered into the cache,
+            # and encoded ones are already served from a stored body
+            if response.status_code != 200 or response.is_streamed or 'Content-Encoding' in response.headers:
+                return response
+            pipeline = redis.pipeline()
+            pipeline.hset(key, mapping=to_entry(response))
+            pipeline.expire(key, timeout)
+            pipeline.sadd(CACHE_KEYS_FMT % family, key)
+            pipeline.execute()
+            return response
+        finally:
+            release(lock, token)
+    deadline = time.monotonic() + FILL_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(FILL_POLL_INTERVAL)
+        entry = redis.hgetall(key)
+        if entry:
+            return from_entry(entry)
+        if not redis.exists(lock):
+            break
+    return render()
+
+
+def cached(family, timeout=None):
+    """
+    Cache a view's response in Redis, keyed by route and normalized query arguments.
+    Keys include the generation of the resource family, so entries are dropped as soon as the scraper changes its data.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                key = cache_key(family)
+                entry = redis.hgetall(key)
+                if entry:
+                    return from_entry(entry)
+                return fill(key, family, timeout or app.config['CACHE_TIMEOUT'],
+                            lambda: view(*args, **kwargs))
+            except RedisError as e:
+                app.logger.warning('Response cache unavailable: %s', e)
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
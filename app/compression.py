@@ -0,0 +1,99 @@
+from flask import request, Response
+
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this aren't worth the overhead of compressing
+MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# In order of preference, between encodings the client likes as much
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate():
+    """
+    :return: the supported encoding with the highest quality the client gives it, or None if it should get an
+    uncompressed body.
+    """
+    qualities = {encoding: request.accept_encodings[encoding] for encoding in ENCODINGS}
+    # Ties go to the first encoding
+    encoding = max(ENCODINGS, key=qualities.get)
+    if not qualities[encoding]:
+        return None
+    return encoding
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_all(body):
+    """
+    Compress a body once in every supported encoding, so it can be stored and served without further work.
+    """
+    if len(body) < MIN_SIZE:
+        return {}
+    return {encoding: compress(body, encoding) for encoding in ENCODINGS}
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress_chunk, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        compressed = compress_chunk(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def compress_response(response):
+    """
+    Compress a response for the client if it accepts an encoding we support and it isn't already compressed.
+    """
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    # Events have to reach the client as soon as they're sent, which compressing would hold back
+    if response.mimetype == 'text/event-stream':
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def make_stored_response(body, variants, mimetype):
+    """
+    Build a response from a body stored alongside its pre-compressed variants, picking one the client accepts.
+    """
+    encoding = negotiate()
+    if variants.get(encoding):
+        response = Response(variants[encoding], mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,149 @@
+from redis import Redis
+from redis.exceptions import RedisError
+
+from app import app, redis
+from app.util import dumps
+
+import queue
+import threading
+import time
+
+HALLS_CHANNEL = 'events:halls'
+# Seconds between comments sent on an idle stream, so proxies don't time it out and gone clients are noticed
+KEEPALIVE_INTERVAL = 15
+# Streams are ended after this many seconds, spreading clients across workers as they reconnect on their own
+STREAM_DURATION = 30 * 60
+# Milliseconds clients wait before reconnecting
+RETRY_INTERVAL = 5000
+# Changes held for a stream that isn't keeping up before it's ended
+STREAM_QUEUE_SIZE = 100
+# Seconds a new stream waits for the process's subscription to be made, and between attempts to make it again
+SUBSCRIBE_TIMEOUT = 5
+RESUBSCRIBE_INTERVAL = 5
+
+# The subscription waits on its connection for as long as no hall changes, which the shared client's socket timeout
+# would keep cutting short, so it has a client of its own relying on keepalives to notice a dead connection
+subscriber = Redis.from_url(app.config['REDIS_URL'],
+                            socket_connect_timeout=app.config['REDIS_CONNECT_TIMEOUT'],
+                            socket_keepalive=True)
+
+
+def format_event(event, data):
+    if isinstance(data, bytes):
+        data = data.decode()
+    return 'event: %s\ndata: %s\n\n' % (event, data)
+
+
+def publish_hall_changes(halls):
+    """
+    Announce serialized halls whose open state or occupancy changed to the clients of /halls/stream.
+    """
+    if not halls:
+        return
+    try:
+        pipeline = redis.pipeline()
+        for hall in halls:
+            pipeline.publish(HALLS_CHANNEL, dumps(hall))
+        pipeline.execute()
+    except RedisError as e:
+        print('Could not publish hall changes:')
+        print(e)
+
+
+class HallChangeHub:
+    """
+    One subscription to hall changes per process, fanned out to a queue for each open stream.
+    However many streams are open, the process only holds one Redis connection for them.
+    Streams whose queue is handed None have to end, as changes may have been missed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = set()
+        self.subscribed = threading.Event()
+        self.thread = None
+
+    def subscribe(self):
+        """
+        :return: queue receiving every hall change from now on.
+        :raises RedisError: if the process couldn't subscribe to hall changes in time.
+        """
+        changes = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self.lock:
+            self.queues.add(changes)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.listen, name='hall-changes', daemon=True)
+                self.thread.start()
+        if not self.subscribed.wait(SUBSCRIBE_TIMEOUT):
+            self.unsubscribe(changes)
+            raise RedisError('Not subscribed to hall changes.')
+        return changes
+
+    def unsubscribe(self, changes):
+        with self.lock:
+            self.queues.discard(changes)
+
+    def publish(self, data):
+        with self.lock:
+            queues = list(self.queues)
+        for changes in queues:
+            try:
+                changes.put_nowait(data)
+            except queue.Full:
+                # Too far behind, so end the stream; the client will read every hall again when it reconnects
+                self.unsubscribe(changes)
+                self.end(changes)
+
+    def end(self, changes):
+        while True:
+            try:
+                changes.get_nowait()
+            except queue.Empty:
+                break
+        changes.put_nowait(None)
+
+    def listen(self):
+        while True:
+            pubsub = subscriber.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(HALLS_CHANNEL)
+                self.subscribed.set()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.publish(message['data'])
+            except RedisError as e:
+                app.logger.warning('Hall change subscription failed: %s', e)
+            finally:
+                pubsub.close()
+            self.subscribed.clear()
+            # Changes published while resubscribing would be lost, so have open streams start over
+            with self.lock:
+                queues = list(self.queues)
+                self.queues.clear()
+            for changes in queues:
+                self.end(changes)
+            time.sleep(RESUBSCRIBE_INTERVAL)
+
+
+hub = HallChangeHub()
+
+
+def stream_hall_changes(changes, halls_body):
+    """
+    Generate a server-sent event stream starting with every hall, then each hall again whenever it changes.
+    :param changes: queue from hub.subscribe, made before the halls were read so no change is missed.
+    """
+    try:
+        yield 'retry: %d\n\n' % RETRY_INTERVAL
+        yield format_event('halls', halls_body)
+        deadline = time.monotonic() + STREAM_DURATION
+        while time.monotonic() < deadline:
+            try:
+                data = changes.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if data is None:
+                break
+            yield format_event('hall', data)
+    finally:
+        hub.unsubscribe(changes)
@@ -0,0 +1,95 @@
+from flask import request, make_response
+from functools import wraps
+from redis.exceptions import RedisError
+
+from app import app, redis
+from app.util import TIMEZONE, date_to_string
+
+import datetime
+import time
+
+GENERATIONS_KEY = 'generations'
+# Set of response cache entries of a family, dropped whenever its generation changes
+CACHE_KEYS_FMT = 'cache:%s:keys'
+
+
+def bump_generation(*families):
+    """
+    Record that the data of the given resource families (halls, managers, meals, items) has changed,
+    and drop their cached responses.
+    """
+    now = int(time.time())
+    try:
+        cache_keys = {family: redis.smembers(CACHE_KEYS_FMT % family) for family in families}
+        pipeline = redis.pipeline()
+        for family in families:
+            pipeline.hincrby(GENERATIONS_KEY, family, 1)
+            pipeline.hset(GENERATIONS_KEY, family + ':modified', now)
+            if cache_keys[family]:
+                pipeline.delete(*cache_keys[family])
+            pipeline.delete(CACHE_KEYS_FMT % family)
+        pipeline.execute()
+    except RedisError as e:
+        print('Could not update data generation:')
+        print(e)
+
+
+def get_generation(family):
+    """
+    :return: the current generation of a resource family and when it was last modified, or None if unknown.
+    """
+    generation, modified = redis.hmget(GENERATIONS_KEY, family, family + ':modified')
+    if generation is None or modified is None:
+        return None
+    return int(generation), datetime.datetime.fromtimestamp(int(modified), datetime.timezone.utc)
+
+
+def is_fresh(etag, modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None:
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return modified <= since
+
+
+def conditional(family, day=None):
+    """
+    Decorate a view whose response only depends on the given resource family.
+    Responses carry an ETag and Last-Modified derived from the family's generation, and requests
+    revalidating the current generation get a 304 without the view, or the database, being touched.
+    :param day: function of the view's arguments returning the local day the response is for when the URL doesn't
+    say so, such as today's menu, or None. The day is then part of the ETag and Last-Modified, so that what was
+    served yesterday isn't revalidated today.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                state = get_generation(family)
+            except RedisError as e:
+                app.logger.warning('Could not read data generation: %s', e)
+                state = None
+            if state is None:
+                return view(*args, **kwargs)
+            generation, modified = state
+            etag = '%s-%d' % (family, generation)
+            current_day = day(*args, **kwargs) if day is not None else None
+            if current_day is not None:
+                etag += '-' + date_to_string(current_day)
+                day_start = TIMEZONE.localize(datetime.datetime.combine(current_day, datetime.time()))
+                modified = max(modified, day_start.astimezone(datetime.timezone.utc))
+            if is_fresh(etag, modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak, as the same generation is served under different content encodings
+            response.set_etag(etag, weak=True)
+            response.last_modified = modified
+            return response
+        return wrapper
+    return decorator
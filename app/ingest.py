@@ -0,0 +1,61 @@
+from app import db
+
+import io
+
+
+def to_row(instance):
+    """
+    Turn a model instance that hasn't been added to the session into a row for bulk inserting.
+    Unset columns get their defaults, and unset primary keys are left for the database to assign.
+    """
+    row = {}
+    for column in instance.__table__.columns:
+        value = getattr(instance, column.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        if value is None and column.primary_key:
+            continue
+        row[column.name] = value
+    return row
+
+
+def copy_value(value):
+    """
+    Encode a value as a field of PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(table, columns, rows):
+    connection = db.session.connection()
+    preparer = connection.dialect.identifier_preparer
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(row[column]) for column in columns) + '\n')
+    buffer.seek(0)
+    columns_sql = ', '.join(preparer.quote(column) for column in columns)
+    statement = 'COPY %s (%s) FROM STDIN' % (preparer.format_table(table), columns_sql)
+    # Runs on the session's own connection, so the rows are part of its transaction
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def bulk_insert(table, rows):
+    """
+    Insert rows, which must all have the same columns, into a table in one go.
+    On PostgreSQL they are streamed in with COPY, and elsewhere inserted with a single executemany.
+    """
+    if not rows:
+        return
+    dialect = db.session.connection().dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        copy_rows(table, list(rows[0]), rows)
+    else:
+        db.session.execute(table.insert(), rows)
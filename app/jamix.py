@@ -0,0 +1,679 @@
+"""
+Browserless client for the JAMIX menu app.
+
+The app is built with Vaadin, which renders everything client-side from a tree of connectors (components)
+described over its UIDL protocol: the server sends shared state, types and hierarchy of connectors as JSON,
+and the browser sends back RPC calls such as button clicks. Speaking that protocol directly lets us walk
+the menus without a browser, waiting only on the server's responses.
+"""
+from bs4 import BeautifulSoup
+
+import copy
+import datetime
+import hashlib
+import json
+import os
+import re
+import requests
+import threading
+import time
+from urllib.parse import quote, urljoin, urlencode
+
+DATE_FMT_JAMIX = '%A, %B %d, %Y'
+# Earliest date with usable menus, where seeking backwards stops
+EARLIEST_DATE = 'Sunday, June 6, 2021'
+MIN_MEALS_ALLOWED = 2
+MEAL_NAME_OVERRIDES = {
+    'OC Dinner': 'Dinner',
+    # TODO: check that this error is still happening, as this override could cause problems
+    'breakfast': 'Lunch',
+    'Breakfast (Pick up at Lunch)': 'Breakfast',
+    'Dinner (Pick up at Lunch)': 'Dinner',
+}
+COURSE_NAME_OVERRIDES = {
+    'Yale Bakery Dessert': 'Dessert',
+    'Smart Meals (must be ordered ahead)': 'Smart Meals',
+}
+
+UIDL_PREFIX = 'for(;;);'
+INIT_RE = re.compile(r'vaadin\.initApplication\(\s*"([^"]+)"\s*,\s*(\{.*?\})\s*\);', re.DOTALL)
+BUTTON = 'com.vaadin.ui.Button'
+LABEL = 'com.vaadin.ui.Label'
+PANEL = 'com.vaadin.ui.Panel'
+TABSHEET = 'com.vaadin.ui.TabSheet'
+VERTICAL_LAYOUT = 'com.vaadin.ui.VerticalLayout'
+# Bitmask of a layout with margins on all four sides
+ALL_MARGINS = 15
+CLICK_DETAILS = {
+    'button': 'LEFT',
+    'clientX': 0,
+    'clientY': 0,
+    'relativeX': 0,
+    'relativeY': 0,
+    'altKey': False,
+    'ctrlKey': False,
+    'metaKey': False,
+    'shiftKey': False,
+    'type': 1,
+}
+
+
+class JamixError(Exception):
+    pass
+
+
+def record_wait(waits, site, start, timed_out=False):
+    """
+    Add the time since start to the telemetry of a call site that waits on the JAMIX app.
+    """
+    wait = waits.setdefault(site, {'count': 0, 'seconds': 0.0, 'timeouts': 0})
+    wait['count'] += 1
+    wait['seconds'] += time.perf_counter() - start
+    if timed_out:
+        wait['timeouts'] += 1
+
+
+def merge_waits(total, waits):
+    for site, wait in waits.items():
+        merged = total.setdefault(site, {'count': 0, 'seconds': 0.0, 'timeouts': 0})
+        for key in merged:
+            merged[key] += wait[key]
+
+
+class NutritionCache:
+    """
+    Nutrition facts of items already scraped, kept between scrapes.
+    The same dishes recur across days and halls, so an item's nutrition pane only needs opening the first time it's seen.
+    Items are keyed by name, course and a fingerprint of their ingredients, so a changed recipe is read again.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        # Shared by all halls being scraped at once
+        self.lock = threading.Lock()
+        self.items = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.items = json.load(f)
+
+    @staticmethod
+    def key(course_name, item_name, item_ingredients):
+        fingerprint = hashlib.sha1(item_ingredients.get('ingredients', '').encode()).hexdigest()
+        return '\t'.join((item_name, course_name, fingerprint))
+
+    def lookup(self, course_name, ingredients):
+        """
+        :return: cached nutrition facts of the given ingredients page's items, by item name.
+        """
+        with self.lock:
+            found = {
+                item_name: self.items.get(self.key(course_name, item_name, item_ingredients))
+                for item_name, item_ingredients in ingredients.items()
+            }
+            # Nutrition facts are modified when read into the database, so hand out copies
+            return {item_name: copy.deepcopy(nutrition) for item_name, nutrition in found.items() if nutrition is not None}
+
+    def update(self, course_name, ingredients, nutrition):
+        with self.lock:
+            for item_name, item_nutrition in nutrition.items():
+                if item_name in ingredients:
+                    self.items[self.key(course_name, item_name, ingredients[item_name])] = copy.deepcopy(item_nutrition)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.items, f)
+            os.replace(self.path + '.tmp', self.path)
+
+
+class MenuCache:
+    """
+    Scraped menus kept between scrapes, as one JSON segment per hall and day.
+    Segments are written whole and renamed into place, so a crash can't corrupt days already cached,
+    and reading a hall's days doesn't mean parsing every other hall's.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def get_hall_path(self, hall_name):
+        # Multi-hall names like 'Ezra Stiles/Morse' aren't valid file names
+        return os.path.join(self.path, quote(hall_name, safe=''))
+
+    def get_dates(self, hall_name):
+        """
+        :return: dates of the days cached for a hall, in order, without reading them.
+        """
+        hall_path = self.get_hall_path(hall_name)
+        if not os.path.isdir(hall_path):
+            return []
+        return sorted(
+            datetime.date.fromisoformat(file_name[:-len('.json')])
+            for file_name in os.listdir(hall_path)
+            if file_name.endswith('.json')
+        )
+
+    def get_last_date(self, hall_name):
+        dates = self.get_dates(hall_name)
+        return dates[-1] if dates else None
+
+    def save_day(self, hall_name, day):
+        """
+        Write a scraped day to its hall's cache, replacing any earlier copy of it.
+        """
+        date = datetime.datetime.strptime(day['date'], DATE_FMT_JAMIX).date()
+        hall_path = self.get_hall_path(hall_name)
+        os.makedirs(hall_path, exist_ok=True)
+        path = os.path.join(hall_path, date.isoformat() + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(day, f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, hall_name, start_date=None):
+        """
+        :return: cached days of a hall from the given date on, in order.
+        """
+        days = []
+        hall_path = self.get_hall_path(hall_name)
+        for date in self.get_dates(hall_name):
+            if start_date is not None and date < start_date:
+                continue
+            with open(os.path.join(hall_path, date.isoformat() + '.json'), 'r') as f:
+                days.append(json.load(f))
+        return days
+
+    def move(self, hall_name, target_name):
+        """
+        Move a hall's cached days to another hall, such as the first of the ones sharing a multi-hall menu.
+        """
+        hall_path = self.get_hall_path(hall_name)
+        target_path = self.get_hall_path(target_name)
+        os.makedirs(target_path, exist_ok=True)
+        for date in self.get_dates(hall_name):
+            file_name = date.isoformat() + '.json'
+            os.replace(os.path.join(hall_path, file_name), os.path.join(target_path, file_name))
+
+    def import_file(self, path):
+        """
+        Split a cache file holding every hall's full history, as used to be kept, into segments.
+        """
+        with open(path, 'r') as f:
+            menus = json.load(f)
+        for hall_name, days in menus.items():
+            for day in days:
+                self.save_day(hall_name, day)
+
+
+class VaadinClient:
+    """
+    Minimal Vaadin client keeping a mirror of the server's connector tree.
+    """
+    def __init__(self, url, session=None, timeout=30):
+        self.url = url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.ui_id = 0
+        self.sync_id = 0
+        self.client_id = 0
+        self.csrf_token = None
+        self.uidl_url = None
+        self.state = {}
+        self.types = {}
+        self.hierarchy = {}
+        self.type_names = {}
+        self.type_parents = {}
+        # Time spent waiting on the server, by RPC method
+        self.waits = {}
+        # The mirrored connector tree can't go stale, so unlike the browser engine this never has to recover or reload
+        self.recoveries = 0
+        self.refreshes = 0
+        # Round trips to the server, by RPC method
+        self.rpcs = {}
+
+    def connect(self):
+        start = time.perf_counter()
+        r = self.session.get(self.url, timeout=self.timeout)
+        r.raise_for_status()
+        match = INIT_RE.search(r.text)
+        if match is None:
+            raise JamixError('Could not find Vaadin bootstrap configuration.')
+        app_id, config = match.group(1), json.loads(match.group(2))
+        service_url = urljoin(r.url, config.get('serviceUrl') or '.')
+        if not service_url.endswith('/'):
+            service_url += '/'
+        self.uidl_url = service_url + 'UIDL/'
+
+        if 'uidl' in config:
+            # UI was initialized eagerly, as part of the bootstrap page
+            uidl = config['uidl']
+            self.ui_id = config.get('v-uiId', 0)
+        else:
+            params = {
+                'v-browserDetails': 1,
+                'theme': config.get('theme', ''),
+                'v-appId': app_id,
+                'v-sh': 1080,
+                'v-sw': 1920,
+                'v-cw': 1920,
+                'v-ch': 1080,
+                'v-curdate': int(time.time() * 1000),
+                'v-tzo': 300,
+                'v-dstd': 60,
+                'v-rtzo': 300,
+                'v-dston': False,
+                'v-vw': 1920,
+                'v-vh': 1080,
+                # The UI reads its query parameters from here, not from the request itself
+                'v-loc': r.url,
+                'v-wn': app_id + '-0.5',
+            }
+            init_url = service_url + '?v-%d' % int(time.time() * 1000)
+            r = self.session.post(init_url, data=params, timeout=self.timeout)
+            r.raise_for_status()
+            response = self.decode(r.text)
+            self.ui_id = response.get('v-uiId', 0)
+            uidl = response['uidl']
+        if isinstance(uidl, str):
+            uidl = json.loads(uidl)
+        self.handle(uidl)
+        record_wait(self.waits, 'connect', start)
+        self.rpcs['connect'] = self.rpcs.get('connect', 0) + 1
+
+    def close(self):
+        self.session.close()
+
+    def decode(self, text):
+        if text.startswith(UIDL_PREFIX):
+            text = text[len(UIDL_PREFIX):]
+        response = json.loads(text)
+        if isinstance(response, list):
+            response = response[0]
+        return response
+
+    def handle(self, uidl):
+        meta = uidl.get('meta', {})
+        if 'appError' in meta or meta.get('sessionExpired'):
+            raise JamixError('Vaadin session failed: %s' % meta)
+        if meta.get('repaintAll'):
+            self.state = {}
+            self.types = {}
+            self.hierarchy = {}
+        if 'Vaadin-Security-Key' in uidl:
+            self.csrf_token = uidl['Vaadin-Security-Key']
+        self.sync_id = uidl.get('syncId', self.sync_id)
+        self.client_id = uidl.get('clientId', self.client_id)
+        for name, type_id in uidl.get('typeMappings', {}).items():
+            self.type_names[str(type_id)] = name
+        for type_id, parent_id in uidl.get('typeInheritanceMap', {}).items():
+            self.type_parents[str(type_id)] = str(parent_id)
+        self.types.update({cid: str(type_id) for cid, type_id in uidl.get('types', {}).items()})
+        for cid, state in uidl.get('state', {}).items():
+            self.state.setdefault(cid, {}).update(state)
+        self.hierarchy.update(uidl.get('hierarchy', {}))
+
+    def call(self, connector_id, interface, method, params):
+        payload = {
+            'csrfToken': self.csrf_token,
+            'rpc': [[connector_id, interface, method, params]],
+            'syncId': self.sync_id,
+            'clientId': self.client_id,
+        }
+        start = time.perf_counter()
+        r = self.session.post(self.uidl_url + '?' + urlencode({'v-uiId': self.ui_id}),
+                              data=json.dumps(payload),
+                              headers={'Content-Type': 'application/json; charset=UTF-8'},
+                              timeout=self.timeout)
+        r.raise_for_status()
+        self.handle(self.decode(r.text))
+        record_wait(self.waits, method, start)
+        self.rpcs[method] = self.rpcs.get(method, 0) + 1
+
+    def click(self, connector_id):
+        self.call(connector_id, 'com.vaadin.shared.ui.button.ButtonServerRpc', 'click', [CLICK_DETAILS])
+
+    def select_tab(self, connector_id, key):
+        self.call(connector_id, 'com.vaadin.shared.ui.tabsheet.TabsheetServerRpc', 'setSelected', [key])
+
+    ######################
+    # Connector tree queries
+
+    def walk(self, root='0'):
+        """
+        Yield connectors under root, depth first in rendering order, like the DOM would be.
+        """
+        stack = [root]
+        while stack:
+            cid = stack.pop()
+            yield cid
+            stack.extend(reversed(self.hierarchy.get(cid, [])))
+
+    def is_a(self, cid, class_name):
+        type_id = self.types.get(cid)
+        while type_id is not None:
+            if self.type_names.get(type_id) == class_name:
+                return True
+            type_id = self.type_parents.get(type_id)
+        return False
+
+    def has_style(self, cid, style):
+        return style in (self.state.get(cid, {}).get('styles') or ())
+
+    def find(self, class_name=None, style=None, root='0'):
+        found = []
+        for cid in self.walk(root):
+            if class_name is not None and not self.is_a(cid, class_name):
+                continue
+            if style is not None and not self.has_style(cid, style):
+                continue
+            found.append(cid)
+        return found
+
+    def find_one(self, class_name=None, style=None, root='0'):
+        found = self.find(class_name=class_name, style=style, root=root)
+        if not found:
+            raise JamixError('No %s with style %s found.' % (class_name, style))
+        return found[0]
+
+    def find_button(self, style):
+        """
+        Find a button with a given style, or the first button inside a component with that style.
+        """
+        return self.find_one(class_name=BUTTON, root=self.find_one(style=style))
+
+    def caption(self, cid):
+        state = self.state.get(cid, {})
+        caption = state.get('caption') or ''
+        if state.get('captionAsHtml'):
+            caption = html_to_text(caption)
+        return caption
+
+    def html(self, cid):
+        return self.state.get(cid, {}).get('text') or ''
+
+    def text(self, cid):
+        """
+        Visible text of a component, with that of its descendant labels on separate lines.
+        """
+        texts = []
+        for child in self.walk(cid):
+            if self.is_a(child, LABEL):
+                state = self.state.get(child, {})
+                text = state.get('text') or ''
+                if state.get('contentMode') == 'HTML':
+                    text = html_to_text(text)
+                texts.append(text)
+            elif self.is_a(child, BUTTON):
+                texts.append(self.caption(child))
+        return '\n'.join(text for text in texts if text)
+
+
+def html_to_text(html):
+    return BeautifulSoup(html, 'html.parser').get_text('\n').strip()
+
+
+######################
+# Parsing shared with the Selenium scraper
+
+
+def parse_serving_size(text):
+    text = text.replace('Nutrition Facts', '').strip()
+    # Chop off parentheses
+    if text and text[0] == '(' and text[-1] == ')':
+        text = text[1:-1]
+    return text
+
+
+def parse_nutrition_lists(serving_size, left_html, right_html):
+    """
+    Parse the nutrition facts table, which is made with two uls, the first of which has the ingredient name
+    and amount of it, and the second of which has the daily values.
+    """
+    nutrition = {
+        'Serving Size': serving_size,
+    }
+    # The elements in the left side list
+    llist = BeautifulSoup(left_html, 'html.parser').findChildren(recursive=False)
+    # The elements in the right side list
+    rlist = BeautifulSoup(right_html, 'html.parser').findChildren(recursive=False)
+    for lside, rside in zip(llist, rlist):
+        # Skip if we're on an empty row
+        if lside.text.strip() == '':
+            continue
+        spans = lside.find_all('span')
+        ingredient = spans[0].text.lstrip('- ')
+        amount = spans[1].text
+        if ingredient == 'Calories':
+            amount = float(amount.replace(',', '').replace(' kcal', ''))
+        nutrition[ingredient] = {
+            'amount': amount,
+        }
+
+        rtext = rside.text.strip(' %')
+        if rtext:
+            nutrition[ingredient]['percent_daily_value'] = int(rtext)
+    return nutrition
+
+
+def parse_ingredient_rows(rows):
+    """
+    Parse the rows of an ingredients page, each given as the list of texts of its labels.
+    Items are listed as a title row (name and diets), a row of ingredients, and optionally a row of allergens.
+    """
+    ingredients = {}
+    rows_processed = 0
+    current_title = None
+    looking_for = 'title'
+    while rows_processed < len(rows):
+        if looking_for == 'title':
+            slots = rows[rows_processed]
+            current_title = slots[0]
+            ingredients[current_title] = {
+                'diets': slots[1],
+            }
+            looking_for = 'ingredients'
+            rows_processed += 1
+        elif looking_for == 'ingredients':
+            ingredients[current_title]['ingredients'] = '\n'.join(rows[rows_processed])
+            looking_for = 'allergens'
+            rows_processed += 1
+        elif looking_for == 'allergens':
+            text = '\n'.join(rows[rows_processed])
+            if text.startswith('Allergens: '):
+                ingredients[current_title]['allergens'] = text.replace('Allergens: ', '')
+                rows_processed += 1
+            looking_for = 'title'
+    return ingredients
+
+
+######################
+# JAMIX navigation
+
+
+class JamixClient(VaadinClient):
+    def __init__(self, url, nutrition_cache=None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.nutrition_cache = nutrition_cache or NutritionCache()
+        # Items whose nutrition facts came from the cache rather than the app
+        self.nutrition_hits = 0
+
+    def get_header_text(self):
+        return self.text(self.find_one(class_name=LABEL, style='label-main-caption'))
+
+    def get_subheader_text(self):
+        return self.text(self.find_one(class_name=LABEL, style='label-sub-caption'))
+
+    def has_menu(self):
+        # When there's no menu, the only panel is the error message
+        return len(self.find(class_name=PANEL)) > 1
+
+    def get_tabs(self):
+        tabsheets = self.find(class_name=TABSHEET)
+        if not tabsheets:
+            return []
+        return [
+            (tabsheets[0], tab['key'], tab.get('caption') or '')
+            for tab in self.state.get(tabsheets[0], {}).get('tabs', [])
+        ]
+
+    def get_courses(self):
+        return self.find(class_name=BUTTON, root=self.find_one(style='menu-sub-view'))
+
+    def get_ingredients_and_nutrition_buttons(self):
+        return [cid for cid in self.find(class_name=BUTTON, style='selection') if self.has_style(cid, 'multiline')]
+
+    def get_item_nutrition_buttons(self):
+        return self.find(class_name=BUTTON, style='nutrition')
+
+    def click_back(self):
+        self.click(self.find_button('button-navigation--previous'))
+
+    def click_previous_date(self):
+        self.click(self.find_button('button-date-selection--previous'))
+
+    def click_next_date(self):
+        self.click(self.find_button('button-date-selection--next'))
+
+    def get_date(self):
+        return datetime.datetime.strptime(self.get_subheader_text(), DATE_FMT_JAMIX)
+
+    def seek_date(self, target_date):
+        target_date = datetime.datetime.strptime(target_date, DATE_FMT_JAMIX)
+        while True:
+            current_date = self.get_date()
+            if current_date == target_date:
+                break
+            if current_date < target_date:
+                self.click_next_date()
+            else:
+                self.click_previous_date()
+
+    def seek_start(self):
+        # Go to earliest available date
+        while True:
+            date = self.get_subheader_text()
+            print('Seeking date ' + date)
+            if EARLIEST_DATE in date:
+                break
+            if not self.has_menu() or len(self.get_tabs()) < MIN_MEALS_ALLOWED:
+                self.click_next_date()
+                break
+            self.click_previous_date()
+
+    def scrape_ingredients(self):
+        layouts = [cid for cid in self.find(class_name=VERTICAL_LAYOUT)
+                   if self.state.get(cid, {}).get('marginsBitmask') == ALL_MARGINS]
+        inner = [cid for cid in self.find(class_name=VERTICAL_LAYOUT, root=layouts[0]) if cid != layouts[0]]
+        rows = [self.text(row).split('\n') for row in self.hierarchy.get(inner[0], [])]
+        print('Found %d rows of ingredients data.' % len(rows))
+        return parse_ingredient_rows(rows)
+
+    def get_serving_size(self):
+        # The serving size is in the caption of the panel nested inside the nutrition facts panel
+        for panel in self.find(class_name=PANEL):
+            nested = [cid for cid in self.find(class_name=PANEL, root=panel) if cid != panel]
+            if nested:
+                return parse_serving_size(self.caption(nested[0]))
+        return ''
+
+    def scrape_nutrition(self):
+        in_panels = set()
+        for panel in self.find(class_name=PANEL):
+            in_panels.update(self.walk(panel))
+        lists = []
+        for label in self.find(class_name=LABEL):
+            if label in in_panels and '<ul' in self.html(label):
+                lists.extend(BeautifulSoup(self.html(label), 'html.parser').find_all('ul'))
+        serving_size = self.get_serving_size()
+        if len(lists) != 2:
+            print('Warning: more than 2 uls found on nutrition page.')
+        return parse_nutrition_lists(serving_size, lists[0].decode_contents(), lists[1].decode_contents())
+
+    def scrape_course_nutrition(self, known):
+        course_nutrition = {
+            'items': {},
+        }
+        items_processed = 0
+        while items_processed < len(self.get_item_nutrition_buttons()):
+            button = self.get_item_nutrition_buttons()[items_processed]
+            item_name = self.caption(button)
+            if item_name in known:
+                items_processed += 1
+                continue
+            print(f'Reading nutrition facts for {item_name}.')
+            self.click(button)
+            course_nutrition['items'][item_name] = self.scrape_nutrition()
+            self.click_back()
+            items_processed += 1
+        return course_nutrition
+
+    def scrape_course(self):
+        course_name = self.get_header_text()
+        course_name = COURSE_NAME_OVERRIDES.get(course_name, course_name)
+        print(f'Parsing course {course_name}.')
+        course = {
+            'name': course_name,
+        }
+        self.click(self.get_ingredients_and_nutrition_buttons()[0])
+        course['ingredients'] = self.scrape_ingredients()
+        self.click_back()
+        course['nutrition'] = {
+            'items': self.nutrition_cache.lookup(course_name, course['ingredients']),
+        }
+        self.nutrition_hits += len(course['nutrition']['items'])
+        if len(course['nutrition']['items']) < len(course['ingredients']):
+            self.click(self.get_ingredients_and_nutrition_buttons()[1])
+            scraped = self.scrape_course_nutrition(known=course['nutrition']['items'])['items']
+            self.click_back()  # to Ingredients/Nutrition Facts Selection pane
+            self.nutrition_cache.update(course_name, course['ingredients'], scraped)
+            course['nutrition']['items'].update(scraped)
+        return course
+
+    def scrape_meal(self, name):
+        meal = {
+            'name': name,
+            'courses': [],
+        }
+        courses = self.get_courses()
+        print('Found %d courses in this meal.' % len(courses))
+        for index in range(len(courses)):
+            self.click(self.get_courses()[index])
+            meal['courses'].append(self.scrape_course())
+            self.click_back()  # to main page/meal
+        return meal
+
+    def scrape_day(self):
+        """
+        Scrape all meals of the date on screen.
+        :return: the day's menu, or None if there is no menu for it.
+        """
+        day = {
+            'date': self.get_subheader_text(),
+            'meals': [],
+        }
+        print('Parsing date %s...' % day['date'])
+        if not self.has_menu():
+            return None
+        tabs = self.get_tabs()
+        if len(tabs) < MIN_MEALS_ALLOWED:
+            print('Not enough tabs are available. Skipping date.')
+            return None
+        print('Found %d tabs on this page.' % len(tabs))
+        for tabsheet, key, caption in tabs:
+            self.select_tab(tabsheet, key)
+            meal_name = MEAL_NAME_OVERRIDES.get(caption, caption)
+            print(f'Checking tab {meal_name}.')
+            day['meals'].append(self.scrape_meal(meal_name))
+        return day
+
+    def scrape_right(self, on_day, until=None):
+        """
+        Scrape days from the one on screen onwards, until a day without a menu or the until date.
+        """
+        while True:
+            day = self.scrape_day()
+            if day is None:
+                break
+            on_day(day)
+            if until is not None and datetime.datetime.strptime(day['date'], DATE_FMT_JAMIX).date() >= until:
+                break
+            self.click_next_date()
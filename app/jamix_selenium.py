@@ -0,0 +1,537 @@
+from app.jamix import (DATE_FMT_JAMIX, EARLIEST_DATE, MIN_MEALS_ALLOWED, MEAL_NAME_OVERRIDES, COURSE_NAME_OVERRIDES,
+                       NutritionCache, parse_serving_size, parse_nutrition_lists, parse_ingredient_rows, record_wait)
+
+import os
+import datetime
+import time
+from selenium import webdriver
+from selenium.common.exceptions import (ElementClickInterceptedException, ElementNotInteractableException,
+                                        JavascriptException, StaleElementReferenceException, TimeoutException)
+from selenium.webdriver.support.ui import WebDriverWait
+
+WAIT_PERIOD = 10
+POLL_PERIOD = 0.05
+SELENIUM_ERRORS = (ElementClickInterceptedException, ElementNotInteractableException, JavascriptException,
+                   StaleElementReferenceException, TimeoutException)
+# Errors after which the page is brought back to where the scrape was, rather than starting the hall over
+RECOVERABLE_ERRORS = (StaleElementReferenceException, ElementClickInterceptedException, ElementNotInteractableException,
+                      JavascriptException, TimeoutException, IndexError)
+# Attempts at an action, each after recovering from the previous one's failure
+MAX_ATTEMPTS = 3
+
+###################################
+# Navigation states
+# Each screen of the app is a state, and the scraper only moves between them through these transitions.
+# Going back always leads to the parent screen, which is what recovery relies on.
+DATE = 'date'
+COURSE = 'course'
+INGREDIENTS = 'ingredients'
+NUTRITION = 'nutrition'
+ITEM = 'item'
+PARENT_SCREENS = {
+    COURSE: DATE,
+    INGREDIENTS: COURSE,
+    NUTRITION: COURSE,
+    ITEM: NUTRITION,
+}
+TRANSITIONS = {
+    (DATE, DATE),
+    (DATE, COURSE),
+    (COURSE, INGREDIENTS),
+    (COURSE, NUTRITION),
+    (NUTRITION, ITEM),
+    *((screen, parent) for screen, parent in PARENT_SCREENS.items()),
+}
+# Vaadin keeps a client per application on the page, which is active while it has a request to the server in flight
+VAADIN_IDLE_SCRIPT = '''
+if (!window.vaadin || !window.vaadin.clients) return false;
+for (var id in window.vaadin.clients) {
+    if (window.vaadin.clients[id].isActive()) return false;
+}
+return true;
+'''
+
+###################################
+# Screen extraction
+# Every WebDriver call is a round trip to the browser, so rather than finding elements and reading them one by one,
+# each screen is read by a single script returning everything the scraper needs from it.
+SCRIPT_HELPERS = '''
+function text(element) {
+    return element ? element.innerText.trim() : '';
+}
+function all(selector, root) {
+    return Array.prototype.slice.call((root || document).querySelectorAll(selector));
+}
+'''
+SCREEN_SCRIPTS = {
+    DATE: SCRIPT_HELPERS + '''
+var courses = document.querySelector('div.v-verticallayout.v-layout.menu-sub-view');
+return {
+    date: text(document.querySelector('.label-sub-caption')),
+    // When there's no menu, the only panel is the error message
+    has_menu: all('.v-panel-content').length > 1,
+    tabs: all('.v-tabsheet .v-caption').map(text),
+    courses: courses ? all('.v-button', courses).map(text) : [],
+};
+''',
+    COURSE: SCRIPT_HELPERS + '''
+return {
+    name: text(document.querySelector('.label-main-caption')),
+};
+''',
+    INGREDIENTS: SCRIPT_HELPERS + '''
+var layout = document.querySelector('.v-verticallayout.v-layout.v-vertical.v-widget.v-has-width.v-margin-top.v-margin-right.v-margin-bottom.v-margin-left .v-verticallayout');
+var rows = Array.prototype.filter.call(layout.children, function (slot) {
+    return slot.classList.contains('v-slot');
+});
+return {
+    rows: rows.map(function (row) {
+        var labels = all('.v-label', row);
+        return labels.length ? labels.map(text) : [text(row)];
+    }),
+};
+''',
+    NUTRITION: SCRIPT_HELPERS + '''
+return {
+    items: all('.v-button.nutrition').map(text),
+};
+''',
+    ITEM: SCRIPT_HELPERS + '''
+return {
+    serving_size: text(document.querySelector('.v-panel-content .v-panel-captionwrap')),
+    lists: all('.v-panel-content ul').map(function (list) {
+        return list.innerHTML;
+    }),
+};
+''',
+}
+# Selectors of the buttons leading from a screen to its child screens
+BUTTON_SELECTORS = {
+    DATE: 'div.v-verticallayout.v-layout.menu-sub-view .v-button',
+    COURSE: '.v-button.v-widget.multiline.v-button-multiline.selection.v-button-selection.icon-align-right.v-button-icon-align-right.v-has-width',
+    NUTRITION: '.v-button.nutrition',
+}
+TAB_SCRIPT = '''
+var tab = document.querySelectorAll('.v-tabsheet .v-caption')[arguments[0]];
+var cell = tab.closest('td.v-tabsheet-tabitemcell');
+return [tab, cell.classList.contains('v-tabsheet-tabitemcell-selected'),
+        document.querySelector('div.v-verticallayout.v-layout.menu-sub-view')];
+'''
+
+
+def create_driver():
+    ops = webdriver.ChromeOptions()
+    ops.add_argument('--disable-gpu')
+    ops.add_argument('--no-sandbox')
+    GOOGLE_CHROME_PATH = os.environ.get('GOOGLE_CHROME_PATH')
+    if GOOGLE_CHROME_PATH:
+        ops.binary_location = GOOGLE_CHROME_PATH
+    CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
+    driver = webdriver.Chrome(executable_path=CHROMEDRIVER_PATH, chrome_options=ops)
+    driver.maximize_window()
+    driver.implicitly_wait(WAIT_PERIOD)
+    return driver
+
+
+def is_stale(element):
+    try:
+        element.is_enabled()
+        return False
+    except StaleElementReferenceException:
+        return True
+
+
+def child_screen(screen, index):
+    """
+    :return: screen reached by clicking the button at the given index of a screen.
+    """
+    if screen == DATE:
+        return COURSE
+    if screen == COURSE:
+        return (INGREDIENTS, NUTRITION)[index]
+    return ITEM
+
+
+class SeleniumClient:
+    """
+    Scraping context for one browser session, driving the JAMIX app through Chrome.
+    Each instance owns its own browser, so several halls can be scraped at once.
+
+    Navigation is tracked as a state machine: the screen we're on, the date and tab shown, and the path of
+    buttons clicked from the date's screen to get there. When the page changes under us, that's enough to go back
+    to the date's screen and replay the path, so the app only needs to be reloaded as a last resort.
+    """
+    def __init__(self, url, nutrition_cache=None):
+        self.url = url
+        self.driver = None
+        self.nutrition_cache = nutrition_cache or NutritionCache()
+        # Items whose nutrition facts came from the cache rather than the app
+        self.nutrition_hits = 0
+        # Time spent waiting on the page, by call site
+        self.waits = {}
+        self.screen = None
+        self.date = None
+        self.tab = 0
+        self.path = []
+        self.recoveries = 0
+        self.refreshes = 0
+        # Round trips to the browser, by screen
+        self.rpcs = {}
+
+    def connect(self):
+        self.driver = create_driver()
+        self.driver.execute = self.count_rpcs(self.driver.execute)
+        self.driver.get(self.url)
+        self.wait_until('connect', self.is_loaded)
+        self.screen = DATE
+        self.date = self.get_subheader_text()
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+    def count_rpcs(self, execute):
+        """
+        Wrap the driver's command executor, which every WebDriver call goes through, to count calls by screen.
+        """
+        def counted(*args, **kwargs):
+            screen = self.screen or 'connect'
+            self.rpcs[screen] = self.rpcs.get(screen, 0) + 1
+            return execute(*args, **kwargs)
+        return counted
+
+    ###################################
+    # Waiting on the page
+
+    def wait_until(self, site, condition):
+        """
+        Wait for a condition on the page, recording how long it took under the given call site.
+        :return: the condition's result.
+        """
+        start = time.perf_counter()
+        try:
+            result = WebDriverWait(self.driver, WAIT_PERIOD, poll_frequency=POLL_PERIOD,
+                                   ignored_exceptions=(StaleElementReferenceException,)).until(condition)
+        except TimeoutException:
+            record_wait(self.waits, site, start, timed_out=True)
+            raise
+        record_wait(self.waits, site, start)
+        return result
+
+    def is_idle(self, driver=None):
+        return self.driver.execute_script(VAADIN_IDLE_SCRIPT)
+
+    def is_loaded(self, driver=None):
+        return self.is_idle() and bool(self.driver.find_elements_by_class_name('label-sub-caption'))
+
+    def click_and_wait(self, site, element, replaced=None):
+        """
+        Click an element and wait until the server has answered and the given element has been re-rendered.
+        By default that is the clicked element itself, as most clicks lead to a different screen.
+        """
+        replaced = element if replaced is None else replaced
+        element.click()
+        self.wait_until(site, lambda driver: is_stale(replaced) and self.is_idle())
+
+    ###################################
+    # Functions for getting UI elements
+
+    def find_now(self, css_selector):
+        """
+        Find elements without waiting for them to appear, for checking what's on screen.
+        """
+        self.driver.implicitly_wait(0)
+        try:
+            return self.driver.find_elements_by_css_selector(css_selector)
+        finally:
+            self.driver.implicitly_wait(WAIT_PERIOD)
+
+    def get_header_text(self):
+        return self.driver.find_element_by_class_name('label-main-caption').text
+
+    def get_subheader_text(self):
+        return self.driver.find_element_by_class_name('label-sub-caption').text
+
+    def is_date_screen(self):
+        return bool(self.find_now('.button-date-selection--next'))
+
+    def extract(self):
+        """
+        Read everything the scraper needs from the current screen in one round trip.
+        """
+        return self.driver.execute_script(SCREEN_SCRIPTS[self.screen])
+
+    def get_buttons(self, screen):
+        """
+        :return: buttons leading from a screen to its child screens.
+        """
+        return self.driver.find_elements_by_css_selector(BUTTON_SELECTORS[screen])
+
+    ###################################
+    # Raw clicks, which don't track where they lead
+
+    def click_back(self):
+        self.click_and_wait('back', self.driver.find_element_by_css_selector('.button-navigation--previous .v-button'))
+
+    def click_date(self, site, button):
+        date = self.get_subheader_text()
+        button.click()
+        self.wait_until(site, lambda driver: self.is_idle() and self.get_subheader_text() != date)
+
+    def click_previous_date(self):
+        self.click_date('previous_date', self.driver.find_element_by_class_name('button-date-selection--previous'))
+
+    def click_next_date(self):
+        self.click_date('next_date', self.driver.find_element_by_class_name('button-date-selection--next'))
+
+    def click_tab(self, index):
+        tab, selected, courses = self.driver.execute_script(TAB_SCRIPT, index)
+        if not selected:
+            # Wait for the previous meal's courses to be replaced
+            self.click_and_wait('tab', tab, replaced=courses)
+
+    def go_to_date(self, target_date):
+        target_date = datetime.datetime.strptime(target_date, DATE_FMT_JAMIX)
+        while True:
+            current_date = datetime.datetime.strptime(self.get_subheader_text(), DATE_FMT_JAMIX)
+            if current_date == target_date:
+                break
+            if current_date < target_date:
+                self.click_next_date()
+            else:
+                self.click_previous_date()
+
+    ###################################
+    # Navigation state machine
+
+    def attempt(self, action):
+        """
+        Run an action on the page. If it fails because the page changed under it,
+        bring the page back to the current navigation state and try again.
+        :return: the action's result.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return action()
+            except RECOVERABLE_ERRORS as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                print('Recovering from error...')
+                print(e)
+                # If recovering in place didn't help the first time, start from a fresh page
+                self.recover(reload=attempt > 0)
+
+    def recover(self, reload=False):
+        """
+        Bring the page back to the current navigation state by going back to the date's screen and replaying the path.
+        The app is only reloaded if that fails, or if asked to.
+        """
+        self.recoveries += 1
+        if not reload:
+            try:
+                self.replay()
+                return
+            except RECOVERABLE_ERRORS as e:
+                print('Could not recover in place, reloading.')
+                print(e)
+        self.refreshes += 1
+        self.driver.refresh()
+        self.wait_until('refresh', self.is_loaded)
+        self.replay()
+
+    def replay(self):
+        for _ in range(len(self.path) + 1):
+            if self.is_date_screen():
+                break
+            self.click_back()
+        self.go_to_date(self.date)
+        if self.path or self.tab:
+            self.click_tab(self.tab)
+        screen = DATE
+        for index in self.path:
+            self.click_and_wait('replay', self.get_buttons(screen)[index])
+            screen = child_screen(screen, index)
+
+    def transition(self, to, action, index=None):
+        """
+        Move to another screen with an action on the current one, and track where that led.
+        """
+        if (self.screen, to) not in TRANSITIONS:
+            raise ValueError('Cannot go from %s screen to %s screen.' % (self.screen, to))
+        self.attempt(action)
+        if to == PARENT_SCREENS.get(self.screen):
+            self.path.pop()
+        elif to == DATE:
+            self.date = self.get_subheader_text()
+            self.tab = 0
+        else:
+            self.path.append(index)
+        self.screen = to
+
+    def open(self, index):
+        """
+        Click the button at the given index of the current screen.
+        """
+        to = child_screen(self.screen, index)
+        self.transition(to, lambda: self.click_and_wait(to, self.get_buttons(self.screen)[index]), index)
+
+    def back(self):
+        self.transition(PARENT_SCREENS[self.screen], self.click_back)
+
+    def previous_date(self):
+        self.transition(DATE, self.click_previous_date)
+
+    def next_date(self):
+        self.transition(DATE, self.click_next_date)
+
+    def select_tab(self, index):
+        self.attempt(lambda: self.click_tab(index))
+        self.tab = index
+
+    def seek_date(self, target_date):
+        """
+        Seek toward a target date.
+        """
+        target_date = datetime.datetime.strptime(target_date, DATE_FMT_JAMIX)
+        while True:
+            current_date = datetime.datetime.strptime(self.date, DATE_FMT_JAMIX)
+            if current_date == target_date:
+                break
+            if current_date < target_date:
+                self.next_date()
+            else:
+                self.previous_date()
+
+    ################################
+    # Scraping process functions
+
+    def seek_start(self):
+        # Go to earliest available date or requested date
+        while True:
+            print('Seeking date ' + self.date)
+            if EARLIEST_DATE in self.date:
+                break
+            screen = self.attempt(self.extract)
+            if not screen['has_menu'] or len(screen['tabs']) < MIN_MEALS_ALLOWED:
+                # The only panel is the no menus error message
+                self.next_date()
+                break
+            self.previous_date()
+
+    def scrape_ingredients(self):
+        """
+        Scrape ingredients page onscreen.
+        """
+        rows = self.extract()['rows']
+        print('Found %d rows of ingredients data.' % len(rows))
+        return parse_ingredient_rows(rows)
+
+    def scrape_nutrition(self):
+        """
+        Scrape a visible nutrition facts pane for an individual item.
+        """
+        screen = self.extract()
+        lists = screen['lists']
+        if len(lists) != 2:
+            print('Warning: more than 2 uls found on nutrition page.')
+        return parse_nutrition_lists(parse_serving_size(screen['serving_size']), lists[0], lists[1])
+
+    def scrape_course_nutrition(self, known):
+        """
+        Scrape nutrition facts for each item in a course not already known, starting from course nutrition page.
+        """
+        course_nutrition = {
+            # The website offers nutrition facts for an entire course, but we ignore this.
+            #'course': scrape_nutrition(),
+            'items': {},
+        }
+        item_names = self.attempt(self.extract)['items']
+        for index, item_name in enumerate(item_names):
+            if item_name in known:
+                continue
+            print(f'Reading nutrition facts for {item_name}.')
+            self.open(index)
+            course_nutrition['items'][item_name] = self.attempt(self.scrape_nutrition)
+            self.back()
+        return course_nutrition
+
+    def scrape_course(self):
+        """
+        Scrape course that has been opened on the screen (i.e. Ingredients and Nutrition Facts buttons are showing).
+        """
+        course_name = self.attempt(self.extract)['name']
+        course_name = COURSE_NAME_OVERRIDES.get(course_name, course_name)
+        print(f'Parsing course {course_name}.')
+        course = {
+            'name': course_name,
+        }
+        self.open(0)
+        course['ingredients'] = self.attempt(self.scrape_ingredients)
+        self.back()
+        course['nutrition'] = {
+            'items': self.nutrition_cache.lookup(course_name, course['ingredients']),
+        }
+        self.nutrition_hits += len(course['nutrition']['items'])
+        if len(course['nutrition']['items']) < len(course['ingredients']):
+            self.open(1)
+            scraped = self.scrape_course_nutrition(known=course['nutrition']['items'])['items']
+            self.back()  # to Ingredients/Nutrition Facts Selection pane
+            self.nutrition_cache.update(course_name, course['ingredients'], scraped)
+            course['nutrition']['items'].update(scraped)
+        return course
+
+    def scrape_meal(self, name):
+        """
+        Scrape the meal currently on the screen.
+        """
+        meal = {
+            'name': name,
+            'courses': [],
+        }
+        courses = self.attempt(self.extract)['courses']
+        print('Found %d courses in this meal.' % len(courses))
+        for index in range(len(courses)):
+            self.open(index)
+            meal['courses'].append(self.scrape_course())
+            self.back()  # to main page/meal
+        return meal
+
+    def scrape_day(self):
+        """
+        Scrape all meals of the date on screen.
+        :return: the day's menu, or None if there is no menu for it.
+        """
+        day = {
+            'date': self.date,
+            'meals': [],
+        }
+        print('Parsing date %s...' % day['date'])
+        screen = self.attempt(self.extract)
+        if not screen['has_menu']:
+            return None
+        tabs = screen['tabs']
+        if len(tabs) < MIN_MEALS_ALLOWED:
+            print('Not enough tabs are available. Skipping date.')
+            return None
+        print('Found %d tabs on this page.' % len(tabs))
+        for index, caption in enumerate(tabs):
+            self.select_tab(index)
+            meal_name = MEAL_NAME_OVERRIDES.get(caption, caption)
+            print(f'Checking tab {meal_name}.')
+            day['meals'].append(self.scrape_meal(meal_name))
+        return day
+
+    def scrape_right(self, on_day, until=None):
+        """
+        Scrape days from the one on screen onwards, until a day without a menu or the until date.
+        Days follow each other on the same page, as any stale elements are recovered from where they happen.
+        """
+        while True:
+            day = self.scrape_day()
+            if day is None:
+                break
+            on_day(day)
+            if until is not None and datetime.datetime.strptime(day['date'], DATE_FMT_JAMIX).date() >= until:
+                break
+            self.next_date()
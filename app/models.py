@@ -1,14 +1,21 @@
 from app import app, db
+from app.util import serializable
 import datetime
+import hashlib
+import json
 
 
 meals_x_items = db.Table(
     'meals_x_items',
     db.Column('meal_id', db.Integer, db.ForeignKey('meals.id'), nullable=False),
     db.Column('item_id', db.Integer, db.ForeignKey('items.id'), nullable=False),
+    # Covering indexes for both directions of the association
+    db.Index('ix_meals_x_items_meal_id_item_id', 'meal_id', 'item_id'),
+    db.Index('ix_meals_x_items_item_id_meal_id', 'item_id', 'meal_id'),
 )
 
 
+@serializable
 class Hall(db.Model):
     __tablename__ = 'halls'
     __serializable__ = ('id', 'name', 'nickname', 'open', 'occupancy', 'latitude', 'longitude', 'address', 'phone')
@@ -26,6 +33,7 @@ class Hall(db.Model):
     meals = db.relationship('Meal', cascade='all,delete', back_populates='hall')
 
 
+@serializable
 class Manager(db.Model):
     __tablename__ = 'managers'
     __serializable__ = ('id', 'name', 'email', 'position', 'hall_id')
@@ -37,7 +45,11 @@ class Manager(db.Model):
     hall_id = db.Column(db.String, db.ForeignKey('halls.id'))
     hall = db.relationship('Hall', back_populates='managers')
 
+    # Sort keys for keyset pagination
+    __keyset__ = [id]
 
+
+@serializable
 class Meal(db.Model):
     __tablename__ = 'meals'
     __serializable__ = ('id', 'name', 'date', 'start_time', 'end_time', 'hall_id')
@@ -50,11 +62,21 @@ class Meal(db.Model):
     hall_id = db.Column(db.String, db.ForeignKey('halls.id'))
     hall = db.relationship('Hall', back_populates='meals')
 
+    # Sort keys for keyset pagination. Missing start times are compared as empty strings
+    # so that they sort consistently across databases and can be compared against a cursor.
+    __keyset__ = (hall_id, date, db.func.coalesce(start_time, ''), id)
+    __table_args__ = (
+        # Serves Meal.search filtered by hall, in order
+        db.Index('ix_meals_keyset', *__keyset__),
+        # Serves Meal.search across all halls filtered by date
+        db.Index('ix_meals_date', date),
+    )
+
     items = db.relationship(
-        'Item', secondary=meals_x_items, lazy='subquery',
+        'Item', secondary=meals_x_items, lazy=True,
         backref=db.backref('meals', lazy=True))
 
-    def search(hall_id=None, date=None, start_date=None, end_date=None):
+    def search_query(hall_id=None, date=None, start_date=None, end_date=None):
         meals = Meal.query
         if hall_id is not None:
             meals = meals.filter_by(hall_id=hall_id)
@@ -65,10 +87,17 @@ class Meal(db.Model):
                 meals = meals.filter(start_date <= Meal.date)
             if end_date is not None:
                 meals = meals.filter(Meal.date <= end_date)
-        meals = meals.order_by(Meal.hall_id, Meal.date, Meal.start_time)
-        return meals.all()
+        meals = meals.order_by(*Meal.__keyset__)
+        return meals
+
+    def search(hall_id=None, date=None, start_date=None, end_date=None):
+        return Meal.search_query(hall_id=hall_id,
+                                 date=date,
+                                 start_date=start_date,
+                                 end_date=end_date).all()
 
 
+@serializable
 class Item(db.Model):
     __tablename__ = 'items'
     __serializable__ = (
@@ -100,9 +129,31 @@ class Item(db.Model):
     # Obsolete
     nuts = db.Column(db.Boolean, default=False)
 
+    # Hash of the fields identifying the item, which scraped items are deduplicated by
+    fingerprint = db.Column(db.String(40), index=True, unique=True)
+
     nutrition = db.relationship('Nutrition', cascade='all,delete,delete-orphan', uselist=False, back_populates='item')
 
+    # Sort keys for keyset pagination
+    __keyset__ = [id]
+    # Fields making up the fingerprint. Tree nut allergens used to be missing, so tree_nut is left out
+    # for items scraped since then to still match, and be corrected.
+    __fingerprinted__ = (
+        'name', 'ingredients', 'course',
+        'meat', 'animal_products', 'alcohol', 'shellfish', 'peanuts', 'dairy', 'egg', 'pork', 'fish', 'soy', 'wheat', 'gluten', 'coconut',
+    )
+
+    def make_fingerprint(self):
+        columns = self.__table__.columns
+        values = [
+            # Flags left unset default to false
+            bool(getattr(self, field)) if isinstance(columns[field].type, db.Boolean) else getattr(self, field)
+            for field in self.__fingerprinted__
+        ]
+        return hashlib.sha1(json.dumps(values).encode()).hexdigest()
 
+
+@serializable
 class Nutrition(db.Model):
     __tablename__ = 'nutrition'
     __serializable__ = (
@@ -151,3 +202,45 @@ class Nutrition(db.Model):
 
     item_id = db.Column(db.Integer, db.ForeignKey('items.id'), primary_key=True)
     item = db.relationship('Item', back_populates='nutrition')
+
+
+class Menu(db.Model):
+    """
+    Fully expanded menu of a hall on a given day, serialized ahead of time when the scraper ingests it.
+    """
+    __tablename__ = 'menus'
+    hall_id = db.Column(db.String, db.ForeignKey('halls.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+    # The body compressed ahead of time, where it's large enough to be worth it
+    body_gzip = db.Column(db.LargeBinary)
+    body_br = db.Column(db.LargeBinary)
+
+
+class Occupancy(db.Model):
+    """
+    Occupancy and open state of a hall at every FastTrack poll on a day, packed into fixed-width arrays.
+    Polls are appended to the day's row, so a day of them takes a couple of kilobytes in a single row.
+    """
+    __tablename__ = 'occupancy'
+    hall_id = db.Column(db.String, db.ForeignKey('halls.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    # Little-endian unsigned 32-bit Unix timestamps, 16-bit occupancies and 8-bit open flags, one of each per poll
+    timestamps = db.Column(db.LargeBinary, nullable=False)
+    occupancies = db.Column(db.LargeBinary, nullable=False)
+    opens = db.Column(db.LargeBinary, nullable=False)
+
+
+class OccupancyRollup(db.Model):
+    """
+    Occupancy of a hall aggregated over an hour or a day, kept up to date as polls come in.
+    """
+    __tablename__ = 'occupancy_rollups'
+    hall_id = db.Column(db.String, db.ForeignKey('halls.id'), primary_key=True)
+    resolution = db.Column(db.String, primary_key=True)
+    # Unix timestamp of the start of the period
+    start = db.Column(db.Integer, primary_key=True)
+    samples = db.Column(db.Integer, nullable=False)
+    occupancy_total = db.Column(db.Integer, nullable=False)
+    occupancy_max = db.Column(db.Integer, nullable=False)
+    open_samples = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,141 @@
+from app import db
+from app.models import Occupancy, OccupancyRollup
+from app.util import TIMEZONE
+
+import array
+import datetime
+import sys
+
+# Array type codes of the packed timestamps, occupancies and open flags
+TIMESTAMP_TYPE = 'I'
+OCCUPANCY_TYPE = 'H'
+OPEN_TYPE = 'B'
+ROLLUP_RESOLUTIONS = ('hour', 'day')
+RESOLUTIONS = ('raw', *ROLLUP_RESOLUTIONS)
+# Most days of history served in one request at each resolution
+MAX_DAYS = {
+    'raw': 7,
+    'hour': 92,
+    'day': 366,
+}
+
+
+def pack(typecode, values):
+    packed = array.array(typecode, values)
+    # Stored little-endian whatever the machine, so that rows can be appended to by simple concatenation
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def get_day_start(date):
+    """
+    :return: Unix timestamp of the start of a local day.
+    """
+    return int(TIMEZONE.localize(datetime.datetime.combine(date, datetime.time())).timestamp())
+
+
+def get_period_start(moment, resolution):
+    """
+    :return: Unix timestamp of the start of the hour or local day containing the given moment.
+    """
+    if resolution == 'hour':
+        return int(moment.replace(minute=0, second=0, microsecond=0).timestamp())
+    return get_day_start(moment.date())
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, TIMEZONE).isoformat()
+
+
+def record_occupancy(states, now):
+    """
+    Append a poll of halls' occupancy and open state to their time series, and add it to their rollups.
+    Halls' rows are read in a fixed number of queries, however many there are.
+    :param states: fields of each hall as read from FastTrack, by ID.
+    :param now: time of the poll, in TIMEZONE.
+    """
+    date = now.date()
+    hall_ids = list(states)
+    series = {
+        row.hall_id: row
+        for row in Occupancy.query.filter(Occupancy.date == date, Occupancy.hall_id.in_(hall_ids))
+    }
+    starts = {resolution: get_period_start(now, resolution) for resolution in ROLLUP_RESOLUTIONS}
+    rollups = {
+        (rollup.hall_id, rollup.resolution): rollup
+        for rollup in OccupancyRollup.query.filter(
+            OccupancyRollup.hall_id.in_(hall_ids),
+            db.or_(*(db.and_(OccupancyRollup.resolution == resolution, OccupancyRollup.start == start)
+                     for resolution, start in starts.items())))
+    }
+    timestamp = int(now.timestamp())
+    for hall_id, state in states.items():
+        occupancy = state['occupancy']
+        is_open = int(state['open'])
+        row = series.get(hall_id)
+        if row is None:
+            row = Occupancy(hall_id=hall_id, date=date, timestamps=b'', occupancies=b'', opens=b'')
+            db.session.add(row)
+        # Some drivers hand binary columns back as memoryviews
+        row.timestamps = bytes(row.timestamps) + pack(TIMESTAMP_TYPE, [timestamp])
+        row.occupancies = bytes(row.occupancies) + pack(OCCUPANCY_TYPE, [occupancy])
+        row.opens = bytes(row.opens) + pack(OPEN_TYPE, [is_open])
+        for resolution, start in starts.items():
+            rollup = rollups.get((hall_id, resolution))
+            if rollup is None:
+                rollup = OccupancyRollup(hall_id=hall_id, resolution=resolution, start=start,
+                                         samples=0, occupancy_total=0, occupancy_max=0, open_samples=0)
+                db.session.add(rollup)
+            rollup.samples += 1
+            rollup.occupancy_total += occupancy
+            rollup.occupancy_max = max(rollup.occupancy_max, occupancy)
+            rollup.open_samples += is_open
+    db.session.commit()
+
+
+def get_occupancy_history(hall_id, start_date, end_date, resolution):
+    """
+    :return: a hall's occupancy on the local days from start_date to end_date, either as every poll
+    or aggregated by hour or day.
+    """
+    if resolution == 'raw':
+        history = []
+        rows = Occupancy.query.filter(Occupancy.hall_id == hall_id,
+                                      Occupancy.date.between(start_date, end_date)) \
+                              .order_by(Occupancy.date)
+        for row in rows:
+            for timestamp, occupancy, is_open in zip(unpack(TIMESTAMP_TYPE, row.timestamps),
+                                                     unpack(OCCUPANCY_TYPE, row.occupancies),
+                                                     unpack(OPEN_TYPE, row.opens)):
+                history.append({
+                    'time': format_timestamp(timestamp),
+                    'occupancy': occupancy,
+                    'open': bool(is_open),
+                })
+        return history
+    start = get_day_start(start_date)
+    end = get_day_start(end_date + datetime.timedelta(days=1))
+    rollups = OccupancyRollup.query.filter(OccupancyRollup.hall_id == hall_id,
+                                           OccupancyRollup.resolution == resolution,
+                                           OccupancyRollup.start >= start,
+                                           OccupancyRollup.start < end) \
+                                   .order_by(OccupancyRollup.start)
+    return [
+        {
+            'time': format_timestamp(rollup.start),
+            'occupancy': round(rollup.occupancy_total / rollup.samples, 2),
+            'max_occupancy': rollup.occupancy_max,
+            # Share of polls in the period at which the hall was open
+            'open': round(rollup.open_samples / rollup.samples, 2),
+        }
+        for rollup in rollups
+    ]
@@ -0,0 +1,78 @@
+from flask import request, abort
+from sqlalchemy import Date, tuple_
+
+from app import db
+from app.util import DATE_FMT, date_to_string
+
+import base64
+import datetime
+import json
+from urllib.parse import urlencode
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def wants_page():
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def encode_cursor(values):
+    values = [date_to_string(value) if isinstance(value, datetime.date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor_value(key, value):
+    """
+    Turn a value from a cursor back into one comparable with its sort key, checking it has the key's type.
+    """
+    if isinstance(key.type, Date):
+        return datetime.datetime.strptime(value, DATE_FMT).date()
+    python_type = key.type.python_type
+    # JSON booleans would otherwise pass for integers
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise TypeError
+    return value
+
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [decode_cursor_value(key, value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def paginate(query, model):
+    """
+    Fetch one page of a query with keyset pagination on the model's __keyset__ sort keys.
+    Rather than an OFFSET, each page starts strictly after the keys of the previous page's last row,
+    so any page costs the same as the first.
+    :return: serialized rows of the page, and response headers linking to the next page if there is one.
+    """
+    keys = model.__keyset__
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = query.order_by(None).order_by(*keys)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        query = query.filter(tuple_(*keys) > tuple_(*decode_cursor(cursor, keys)))
+    # Select the sort keys after the serialized columns so the last row can be turned into a cursor.
+    # They're labelled so they aren't deduplicated against serialized columns of the same name.
+    labelled_keys = [key.label('cursor_%d' % index) for index, key in enumerate(keys)]
+    statement = query.with_entities(*model.__projection__, *labelled_keys).limit(limit + 1).statement
+    rows = db.session.execute(statement).fetchall()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        args = request.args.copy()
+        args['limit'] = limit
+        args['cursor'] = encode_cursor(rows[-1][len(model.__projection__):])
+        # Relative, as the scheme and host the request came in on may not be those the client used behind a proxy
+        headers['Link'] = '<%s?%s>; rel="next"' % (request.script_root + request.path,
+                                                   urlencode(list(args.items(multi=True))))
+    serialize_row = model.__row_serializer__
+    return [serialize_row(row) for row in rows], headers
@@ -1,28 +1,45 @@
-from app import app, db, celery
-from app.models import Hall, Manager, Meal, Item, Nutrition
+from app import app, db, celery, redis
+from app.models import Hall, Manager, Meal, Item, Nutrition, meals_x_items
 from app.mail import send_scraper_report
+from app.snapshots import materialize_menus, get_unmaterialized_dates
+from app.generations import bump_generation, get_generation
+from app.ingest import bulk_insert, to_row
+from app.occupancy import record_occupancy
+from app.events import publish_hall_changes
+from app.util import TIMEZONE
 
 from celery.schedules import crontab
+from redis.exceptions import RedisError
 
 import os
 import requests
 import json
 import datetime
-import pytz
 import re
-from bs4 import BeautifulSoup
 import time
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from random import randint
-from selenium import webdriver
-from selenium.common.exceptions import ElementClickInterceptedException, ElementNotInteractableException
+from app.jamix import (DATE_FMT_JAMIX, EARLIEST_DATE, MIN_MEALS_ALLOWED, JamixClient, JamixError, MenuCache,
+                       NutritionCache, merge_waits)
+try:
+    from app.jamix_selenium import SeleniumClient, SELENIUM_ERRORS
+except ImportError:
+    # Selenium is only needed for the browser-based fallback engine
+    SeleniumClient = None
+    SELENIUM_ERRORS = ()
 
-DATE_FMT = '%Y-%m-%d'
-DATE_FMT_JAMIX = '%A, %B %d, %Y'
 TIME_FMT = '%H:%M'
-TIMEZONE = pytz.timezone('America/New_York')
-WAIT_PERIOD = 10
+MENU_DIR = 'menus'
+# Whole-history menu cache file kept before MENU_DIR, imported into it if found
 MENU_FILE = 'menus.json'
-MIN_MEALS_ALLOWED = 2
+# Held while MENU_FILE is imported, and how many seconds that may take
+MENU_FILE_LOCK = 'lock:' + MENU_FILE
+MENU_FILE_LOCK_TIMEOUT = 10 * 60
+NUTRITION_FILE = 'nutrition.json'
+# Validators of the hall pages managers were last read from, for revalidating them
+MANAGER_PAGES_FILE = 'manager_pages.json'
+JAMIX_URL = app.config['JAMIX_URL'] + '?anro=97939&k=%d'
 FASTTRACK_NAME_OVERRIDES = {
     'Franklin': 'Benjamin Franklin',
     'Stiles': 'Ezra Stiles',
@@ -57,39 +74,15 @@ HALL_IDS = {
     'Timothy Dwight': 'TD',
     'Trumbull': 'TC',
 }
-MEAL_NAME_OVERRIDES = {
-    'OC Dinner': 'Dinner',
-    # TODO: check that this error is still happening, as this override could cause problems
-    'breakfast': 'Lunch',
-    'Breakfast (Pick up at Lunch)': 'Breakfast',
-    'Dinner (Pick up at Lunch)': 'Dinner',
-}
-COURSE_NAME_OVERRIDES = {
-    'Yale Bakery Dessert': 'Dessert',
-    'Smart Meals (must be ordered ahead)': 'Smart Meals',
-}
+# Number of keys looked up at a time when fetching the IDs of bulk inserted rows
+LOOKUP_CHUNK_SIZE = 500
+SCRAPE_ERRORS = (JamixError, requests.RequestException, *SELENIUM_ERRORS)
+# Errors a hall's scrape is started over after, up to JAMIX_MAX_RESTARTS times
+RESTARTED_ERRORS = (*SCRAPE_ERRORS, IndexError, KeyError, ValueError)
 ITEM_NAME_OVERRIDES = {
     'Nut-Free Basil Pesto (basil, canola oil, extra virgin olive oil, romano cheese, pasteurized sheep\'s milk, rennet, garlic, salt)': 'Nut-Free Basil Pesto',
 }
 
-driver = None
-
-
-def create_driver():
-    # TODO: using globals is bad practice.
-    global driver
-
-    ops = webdriver.ChromeOptions()
-    ops.add_argument('--disable-gpu')
-    ops.add_argument('--no-sandbox')
-    GOOGLE_CHROME_PATH = os.environ.get('GOOGLE_CHROME_PATH')
-    if GOOGLE_CHROME_PATH:
-        ops.binary_location = GOOGLE_CHROME_PATH
-    CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
-    driver = webdriver.Chrome(executable_path=CHROMEDRIVER_PATH, chrome_options=ops)
-    driver.maximize_window()
-    driver.implicitly_wait(WAIT_PERIOD)
-
 
 def round_increment(number, increment):
     return round(number / increment) * increment
@@ -235,16 +228,45 @@ def read_nutrition_facts(raw):
     return nutrition
 
 
-def has_active_meal(hall):
-    now = datetime.datetime.now(TIMEZONE)
-    date = now.strftime(DATE_FMT)
+# Today's meal times by hall, read again once the day or the meals generation changes
+meal_schedule = {
+    'key': None,
+    'meals': {},
+}
+# Fields of each hall as last read from FastTrack, by ID, so that halls which haven't changed aren't touched
+fasttrack_state = {}
+# Occupancies made up for halls that FastTrack shows as closed during a meal, by ID
+estimated_occupancies = {}
+
+
+def get_meal_schedule(date):
+    """
+    :return: start and end times of each hall's meals on the given date, by hall ID.
+    """
+    try:
+        generation = get_generation('meals')
+    except RedisError as e:
+        print('Could not read meals generation:')
+        print(e)
+        generation = None
+    key = (date, generation)
+    # Without a generation there's no telling whether meals have changed, so read them again
+    if generation is None or meal_schedule['key'] != key:
+        meals = {}
+        for hall_id, start_time, end_time in db.session.query(Meal.hall_id, Meal.start_time, Meal.end_time) \
+                                                       .filter(Meal.date == date):
+            meals.setdefault(hall_id, []).append((start_time, end_time))
+        meal_schedule['key'] = key
+        meal_schedule['meals'] = meals
+    return meal_schedule['meals']
+
+
+def has_active_meal(hall_id, now, schedule):
     # TODO: we don't always want to use this default... but for now it's fine
-    hall_id = app.config['FALLBACK_HALL_ID'] or hall.id
-    meals = Meal.query.filter_by(hall_id=hall_id,
-                                 date=date).all()
+    hall_id = app.config['FALLBACK_HALL_ID'] or hall_id
     time = now.strftime(TIME_FMT)
-    for meal in meals:
-        if meal.start_time < time < meal.end_time:
+    for start_time, end_time in schedule.get(hall_id, []):
+        if start_time is not None and end_time is not None and start_time < time < end_time:
             return True
     return False
 
@@ -263,6 +285,9 @@ def scrape_fasttrack():
         {data['COLUMNS'][index]: entry[index] for index in range(len(entry))}
         for entry in data['DATA']
     ]
+    now = datetime.datetime.now(TIMEZONE)
+    schedule = get_meal_schedule(now.date())
+    states = {}
     for raw in data:
         if raw['TYPE'] != 'Residential':
             continue
@@ -270,135 +295,193 @@ def scrape_fasttrack():
         #hall_id = int(raw['ID_LOCATION'])
         name = raw['DININGLOCATIONNAME']
         hall_id = HALL_IDS[name]
-        hall = Hall.query.get(hall_id)
-        if hall is None:
-            hall = Hall(id=hall_id)
+        state = {}
         # TODO: I can't figure out what this is for, so just omit it for now.
-        #hall.code = int(raw['LOCATIONCODE']),
+        #state['code'] = int(raw['LOCATIONCODE']),
         # Get custom name override, falling back to provided name where applicable
-        hall.name = FASTTRACK_NAME_OVERRIDES.get(name, name)
-        hall.nickname = NICKNAMES.get(hall.name, hall.name)
-        hall.occupancy = raw['CAPACITY']
-        hall.open = not bool(raw['ISCLOSED'])
+        state['name'] = FASTTRACK_NAME_OVERRIDES.get(name, name)
+        state['nickname'] = NICKNAMES.get(state['name'], state['name'])
+        state['occupancy'] = raw['CAPACITY']
+        state['open'] = not bool(raw['ISCLOSED'])
         # Override missing status information from API
-        if not hall.open:
-            hall.open = has_active_meal(hall)
-            if hall.open:
-                hall.occupancy = randint(0, 3)
-        hall.address = raw['ADDRESS']
-        hall.phone = raw['PHONE']
+        if not state['open'] and has_active_meal(hall_id, now, schedule):
+            state['open'] = True
+            # Made up once per meal rather than on every poll, so that it doesn't count as a change each time
+            state['occupancy'] = estimated_occupancies.setdefault(hall_id, randint(0, 3))
+        else:
+            estimated_occupancies.pop(hall_id, None)
+        state['address'] = raw['ADDRESS']
+        state['phone'] = raw['PHONE']
         # Ignore manager fields as they're now outdated.
-        print('Parsing ' + hall.name)
+        print('Parsing ' + state['name'])
         geolocation = raw.get('GEOLOCATION')
         if geolocation is not None:
-            hall.latitude, hall.longitude = [float(coordinate) for coordinate in geolocation.split(',')]
-        db.session.add(hall)
-    db.session.commit()
+            state['latitude'], state['longitude'] = [float(coordinate) for coordinate in geolocation.split(',')]
+        states[hall_id] = state
+    changed_ids = [hall_id for hall_id, state in states.items() if fasttrack_state.get(hall_id) != state]
+    if changed_ids:
+        halls = {hall.id: hall for hall in Hall.query.filter(Hall.id.in_(changed_ids))}
+        # Halls whose status changed, serialized for clients of /halls/stream
+        status_changes = []
+        for hall_id in changed_ids:
+            hall = halls.get(hall_id)
+            if hall is None:
+                hall = Hall(id=hall_id)
+                db.session.add(hall)
+            state = states[hall_id]
+            status_changed = hall.open != state['open'] or hall.occupancy != state['occupancy']
+            for field, value in state.items():
+                setattr(hall, field, value)
+            if status_changed:
+                status_changes.append(Hall.__serializer__(hall))
+        changed = bool(db.session.new) or any(db.session.is_modified(hall) for hall in db.session.dirty)
+        db.session.commit()
+        for hall_id in changed_ids:
+            fasttrack_state[hall_id] = states[hall_id]
+        if changed:
+            bump_generation('halls')
+        publish_hall_changes(status_changes)
+    else:
+        print('FastTrack data unchanged.')
+    # Every poll goes into the occupancy history, changed or not
+    record_occupancy(states, now)
+    bump_generation('occupancy')
     print('Done reading FastTrack data.')
 
 
-def scrape_managers():
-    print('Scraping managers.')
-    ROOT = 'https://hospitality.yale.edu/residential-dining/'
-    halls = Hall.query.all()
-    HEADER_RE = re.compile(r'Management Team')
-    Manager.query.delete()
-    for hall in halls:
-        slug = hall.name.lower().replace(' ', '-')
-        custom_slugs = {
-            'franklin': 'benjamin-franklin',
-            'stiles': 'ezra-stiles',
-        }
-        if slug in custom_slugs:
-            slug = custom_slugs[slug]
-        print(slug)
-        r = requests.get(ROOT + slug)
-        soup = BeautifulSoup(r.text, 'html.parser')
-        h2 = soup.find('h2', text=HEADER_RE)
-        ul = h2.find_next()
-        if ul.name == 'p':
-            to_scan = [ul]
-        elif ul.name == 'ul':
-            to_scan = ul.find_all('li')
-        for li in to_scan:
-            contents = li.contents
-            manager = Manager()
-            if len(contents) == 1:
-                # The name is not a link, so no email is available
-                manager.name, manager.position = contents[0].split(', ')
-            elif len(contents) == 2:
-                manager.name = contents[0].text
-                manager.email = contents[0]['href'].replace('mailto:', '')
-                manager.position = contents[1].lstrip(', ').replace('/ ', '/').replace(' /', '/')
-            db.session.add(manager)
-            manager.hall = hall
-            print('Name: ' + manager.name)
-            print('Email: %s' % manager.email)
-            print('Position: %s' % manager.position)
-    db.session.commit()
-
-
-####################################
-# JAMIX Selenium Web Parsing Section
-
-###################################
-# Functions for getting UI elements
-
-
-def get_header_text():
-    return driver.find_element_by_class_name('label-main-caption').text
-
-
-def get_subheader_text():
-    return driver.find_element_by_class_name('label-sub-caption').text
-
-
-def get_tabs():
-    driver.implicitly_wait(1)
-    tabs_bar = driver.find_elements_by_class_name('v-tabsheet')
-    driver.implicitly_wait(WAIT_PERIOD)
-    if len(tabs_bar) == 0:
-        return []
-    return tabs_bar[0].find_elements_by_class_name('v-caption')
-
-
-def get_courses():
-    courses = driver.find_element_by_css_selector('div.v-verticallayout.v-layout.menu-sub-view').find_elements_by_class_name('v-button')
-    return courses
-
-
-def get_ingredients_and_nutrition_buttons():
-    return driver.find_elements_by_css_selector('.v-button.v-widget.multiline.v-button-multiline.selection.v-button-selection.icon-align-right.v-button-icon-align-right.v-has-width')
-
-
-def get_serving_size():
-    text = driver.find_element_by_css_selector('.v-panel-content .v-panel-captionwrap').text.replace('Nutrition Facts\n', '')
-    # Chop off parentheses
-    if text[0] == '(' and text[-1] == ')':
-        text = text[1:-1]
-    return text
+def get_manager_slug(hall):
+    slug = hall.name.lower().replace(' ', '-')
+    custom_slugs = {
+        'franklin': 'benjamin-franklin',
+        'stiles': 'ezra-stiles',
+    }
+    if slug in custom_slugs:
+        slug = custom_slugs[slug]
+    return slug
 
 
-def get_item_nutrition_buttons():
-    return driver.find_elements_by_css_selector('.v-button.nutrition')
+def parse_managers(html):
+    """
+    :return: name, email and position of each manager listed on a hall's page.
+    """
+    HEADER_RE = re.compile(r'Management Team')
+    soup = BeautifulSoup(html, 'html.parser')
+    h2 = soup.find('h2', text=HEADER_RE)
+    ul = h2.find_next()
+    if ul.name == 'p':
+        to_scan = [ul]
+    elif ul.name == 'ul':
+        to_scan = ul.find_all('li')
+    managers = []
+    for li in to_scan:
+        contents = li.contents
+        email = None
+        if len(contents) == 1:
+            # The name is not a link, so no email is available
+            name, position = contents[0].split(', ')
+        elif len(contents) == 2:
+            name = contents[0].text
+            email = contents[0]['href'].replace('mailto:', '')
+            position = contents[1].lstrip(', ').replace('/ ', '/').replace(' /', '/')
+        managers.append((name, email, position))
+    return managers
+
+
+def fetch_managers(session, slug, validators):
+    """
+    Fetch a hall's page, revalidating it against the ETag and Last-Modified date it had when last fetched.
+    :return: managers listed on the page, or None if it hasn't changed, and its new validators.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    r = session.get(app.config['MANAGERS_URL'] + slug, headers=headers, timeout=30)
+    if r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    validators = {
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+    }
+    return parse_managers(r.text), validators
 
 
-def click_back():
-    sleep()
-    driver.find_element_by_css_selector('.button-navigation--previous .v-button').click()
-    sleep()
+def update_managers(hall, managers, existing_managers):
+    """
+    Bring a hall's managers in line with those listed on its page, leaving unchanged ones alone.
+    :return: whether any managers were added or removed.
+    """
+    remaining = list(existing_managers)
+    changed = False
+    for name, email, position in managers:
+        existing_manager = next((manager for manager in remaining
+                                 if (manager.name, manager.email, manager.position) == (name, email, position)), None)
+        if existing_manager is not None:
+            remaining.remove(existing_manager)
+            continue
+        manager = Manager(name=name, email=email, position=position)
+        db.session.add(manager)
+        manager.hall = hall
+        changed = True
+        print('Name: ' + manager.name)
+        print('Email: %s' % manager.email)
+        print('Position: %s' % manager.position)
+    for manager in remaining:
+        print('Removing ' + manager.name)
+        db.session.delete(manager)
+        changed = True
+    return changed
 
 
-def click_previous_date():
-    previous_date_button = driver.find_element_by_class_name('button-date-selection--previous')
-    previous_date_button.click()
-    sleep()
+def scrape_managers():
+    print('Scraping managers.')
+    halls = Hall.query.all()
+    existing_managers = {hall.id: [] for hall in halls}
+    for manager in Manager.query.all():
+        existing_managers.setdefault(manager.hall_id, []).append(manager)
+    if os.path.exists(MANAGER_PAGES_FILE):
+        with open(MANAGER_PAGES_FILE, 'r') as f:
+            pages = json.load(f)
+    else:
+        pages = {}
+    pool_size = app.config['MANAGERS_POOL_SIZE']
+    changed = False
+    # Reuse connections to the site across halls, which are fetched concurrently
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=pool_size) as pool:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        futures = {
+            pool.submit(fetch_managers, session, get_manager_slug(hall), pages.get(get_manager_slug(hall), {})): hall
+            for hall in halls
+        }
+        for future in as_completed(futures):
+            hall = futures[future]
+            slug = get_manager_slug(hall)
+            print(slug)
+            try:
+                managers, pages[slug] = future.result()
+            except requests.RequestException as e:
+                print('Could not fetch managers:')
+                print(e)
+                continue
+            if managers is None:
+                print('Page unchanged.')
+                continue
+            changed |= update_managers(hall, managers, existing_managers[hall.id])
+    db.session.commit()
+    # Only remember the pages once what they listed is saved
+    with open(MANAGER_PAGES_FILE + '.tmp', 'w') as f:
+        json.dump(pages, f)
+    os.replace(MANAGER_PAGES_FILE + '.tmp', MANAGER_PAGES_FILE)
+    if changed:
+        bump_generation('managers')
 
 
-def click_next_date():
-    next_date_button = driver.find_element_by_class_name('button-date-selection--next')
-    next_date_button.click()
-    sleep()
+####################################
+# JAMIX Web Parsing Section
 
 
 def clean_hall_name(hall_name):
@@ -407,13 +490,6 @@ def clean_hall_name(hall_name):
         hall_name = JAMIX_HALL_NAMES[hall_name]
     return hall_name
 
-######################
-# Other util functions
-
-
-def sleep():
-    time.sleep(0.5)
-
 
 def day_after(date):
     """
@@ -423,252 +499,21 @@ def day_after(date):
     return fut.strftime(DATE_FMT_JAMIX)
 
 
-def seek_date(target_date) -> bool:
-    """
-    Seek toward a target date.
-    :return: whether the date has been reached.
-    """
-    target_date = datetime.datetime.strptime(target_date, DATE_FMT_JAMIX)
-    while True:
-        current_date = get_subheader_text()
-        current_date = datetime.datetime.strptime(current_date, DATE_FMT_JAMIX)
-        if current_date == target_date:
-            break
-        if current_date < target_date:
-            click_next_date()
-        else:
-            click_previous_date()
-        sleep()
-
-
-################################
-# Scraping process functions
-
-
-def seek_start(start_date=None):
-    # Go to earliest available date or requested date
-    while True:
-        panels = driver.find_elements_by_class_name('v-panel-content')
-        date = get_subheader_text()
-        print('Seeking date ' + date)
-        if 'Sunday, June 6, 2021' in date:
-            sleep()
-            break
-        if len(panels) == 1 or len(get_tabs()) < MIN_MEALS_ALLOWED:
-            # The only panel is the no menus error message
-            click_next_date()
-            break
-        click_previous_date()
-        sleep()
-        sleep()
-
-
-def scrape_ingredients():
-    """
-    Scrape ingredients page onscreen.
-    """
-    sleep()
-    ingredients = {}
-    rows = driver.find_element_by_css_selector('.v-verticallayout.v-layout.v-vertical.v-widget.v-has-width.v-margin-top.v-margin-right.v-margin-bottom.v-margin-left .v-verticallayout').find_elements_by_xpath('./div[contains(@class, "v-slot")]')
-    print('Found %d rows of ingredients data.' % len(rows))
-    rows_processed = 0
-    current_title = None
-    looking_for = 'title'
-    while rows_processed < len(rows):
-        if looking_for == 'title':
-            slots = rows[rows_processed].find_elements_by_css_selector('.v-label')
-            current_title = slots[0].text
-            ingredients[current_title] = {
-                'diets': slots[1].text,
-            }
-            looking_for = 'ingredients'
-            rows_processed += 1
-        elif looking_for == 'ingredients':
-            ingredients[current_title]['ingredients'] = rows[rows_processed].text
-            looking_for = 'allergens'
-            rows_processed += 1
-        elif looking_for == 'allergens':
-            text = rows[rows_processed].text
-            if text.startswith('Allergens: '):
-                ingredients[current_title]['allergens'] = text.replace('Allergens: ', '')
-                rows_processed += 1
-            looking_for = 'title'
-    return ingredients
-
-
-def scrape_nutrition():
-    """
-    Scrape a visible nutrition facts pane, whether for a full course or an individual item.
-    """
-    nutrition = {
-        'Serving Size': get_serving_size(),
-    }
-    lists = driver.find_elements_by_css_selector('.v-panel-content ul')
-    if len(lists) != 2:
-        print('Warning: more than 2 uls found on nutrition page.')
-    # The nutrition facts table is made with two uls, the first of which has the ingredient name and amount of it,
-    # and the second of which has the daily values.
-    # The elements in the left side list
-    llist = BeautifulSoup(lists[0].get_attribute('innerHTML'), 'html.parser').findChildren(recursive=False)
-    # The elements in the right side list
-    rlist = BeautifulSoup(lists[1].get_attribute('innerHTML'), 'html.parser').findChildren(recursive=False)
-    for lside, rside in zip(llist, rlist):
-        # Skip if we're on an empty row
-        if lside.text.strip() == '':
-            continue
-        spans = lside.find_all('span')
-        ingredient = spans[0].text.lstrip('- ')
-        amount = spans[1].text
-        if ingredient == 'Calories':
-            amount = float(amount.replace(',', '').replace(' kcal', ''))
-        nutrition[ingredient] = {
-            'amount': amount,
-        }
-
-        rtext = rside.text.strip(' %')
-        if rtext:
-            nutrition[ingredient]['percent_daily_value'] = int(rtext)
-    return nutrition
-
-
-def scrape_course_nutrition():
-    """
-    Scrape nutrition facts for each item in a course, starting from course nutrition page.
-    """
-    course_nutrition = {
-        # The website offers nutrition facts for an entire course, but we ignore this.
-        #'course': scrape_nutrition(),
-        'items': {},
-    }
-    items = get_item_nutrition_buttons()
-    if items:
-        items_processed = 0
-        while items_processed < len(items):
-            # TODO: stop this from running twice on the first go. And same with other such constructs in this file.
-            items = get_item_nutrition_buttons()
-            item_name = items[items_processed].text
-            print(f'Reading nutrition facts for {item_name}.')
-            items[items_processed].click()
-            sleep()
-
-            course_nutrition['items'][item_name] = scrape_nutrition()
-
-            click_back()
-
-            items_processed += 1
-    return course_nutrition
-
-
-def scrape_course():
-    """
-    Scrape course that has been opened on the screen (i.e. Ingredients and Nutrition Facts buttons are showing).
-    """
-    course_name = get_header_text()
-    course_name = COURSE_NAME_OVERRIDES.get(course_name, course_name)
-    print(f'Parsing course {course_name}.')
-    course = {
-        'name': course_name,
-    }
-    # Grab and parse Ingredients page
-    in_buttons = get_ingredients_and_nutrition_buttons()
-    in_buttons[0].click()
-    sleep()
-
-    course['ingredients'] = scrape_ingredients()
-
-    click_back()
-    # Do again to reattach to the list
-    in_buttons = get_ingredients_and_nutrition_buttons()
-    in_buttons[1].click()
-    sleep()
-
-    course['nutrition'] = scrape_course_nutrition()
-
-    click_back()  # to Ingredients/Nutrition Facts Selection pane
-    sleep()
-    return course
+menu_cache = MenuCache(MENU_DIR)
+nutrition_cache = NutritionCache(NUTRITION_FILE)
 
 
-def scrape_meal(name):
+def import_menu_file():
     """
-    Scrape the meal currently on the screen.
+    Split the whole-history menu cache kept before MENU_DIR into segments, if it hasn't been yet.
+    Only one process imports it at a time, and the others wait, so that none scrape with half of it.
     """
-    meal = {
-        'name': name,
-        'courses': [],
-    }
-    courses = get_courses()
-    print('Found %d courses in this meal.' % len(courses))
-    courses_processed = 0
-    while courses_processed < len(courses):
-        # Old references will be stale, so we must regenerate element list
-        courses = get_courses()
-        courses[courses_processed].click()
-        sleep()
-
-        meal['courses'].append(scrape_course())
-
-        click_back()  # to main page/meal
-        sleep()
-        courses_processed += 1
-    return meal
-
-
-if os.path.exists(MENU_FILE):
-    with open(MENU_FILE, 'r') as f:
-        menus = json.load(f)
-else:
-    menus = {}
-
-
-def scrape_right(hall_name):
-    print('Parsing ' + hall_name)
-
-    # Cycle through dates, collecting data
-    while True:
-        today_menu = {
-            'date': get_subheader_text(),
-            'meals': [],
-        }
-
-        print('Parsing date %s...' % today_menu['date'])
-
-        panels = driver.find_elements_by_class_name('v-panel-content')
-        if len(panels) == 1:
-            break
-        sleep()
-        tabs = get_tabs()
-        has_tabs = (len(tabs) >= MIN_MEALS_ALLOWED)
-        if has_tabs:
-            print('Found %d tabs on this page.' % len(tabs))
-            tabs_processed = 0
-            while tabs_processed < len(tabs):
-                # TODO: remove repetition
-                tabs = get_tabs()
-                sleep()
-                tabs[tabs_processed].click()
-                sleep()
-                meal_name = tabs[tabs_processed].text
-                meal_name = MEAL_NAME_OVERRIDES.get(meal_name, meal_name)
-                print(f'Checking tab {meal_name}.')
-
-                today_menu['meals'].append(scrape_meal(meal_name))
-
-                tabs_processed += 1
-        else:
-            print('Not enough tabs are available. Skipping date.')
-            break
-
-        menus[hall_name].append(today_menu)
-        with open(MENU_FILE, 'w') as f:
-            json.dump(menus, f)
-        # Uncomment to work around the removed buttons issue, but makes everything less efficient.
-        driver.refresh()
-        seek_date(today_menu['date'])
-        click_next_date()
-        sleep()
-
-    return True
+    with redis.lock(MENU_FILE_LOCK, timeout=MENU_FILE_LOCK_TIMEOUT, blocking_timeout=MENU_FILE_LOCK_TIMEOUT):
+        if not os.path.exists(MENU_FILE):
+            return
+        print('Importing ' + MENU_FILE)
+        menu_cache.import_file(MENU_FILE)
+        os.replace(MENU_FILE, MENU_FILE + '.imported')
 
 
 def get_last_day(hall_name):
@@ -682,50 +527,130 @@ def get_last_day(hall_name):
     print(hall_name)
     hall = Hall.query.filter_by(name=hall_name).first()
     print(hall)
-    last_meal = Meal.query.filter_by(hall_id=hall.id).order_by(Meal.date.desc()).first()
+    last_meal = Meal.query.filter_by(hall_id=hall.id).order_by(Meal.date.desc()).first() if hall else None
     last_day = last_meal.date if last_meal else None
-    if hall_name in menus and menus[hall_name]:
-        last_cached_day = datetime.datetime.strptime(menus[hall_name][-1]['date'], DATE_FMT_JAMIX).date()
-        # Make lexicographic comparison
+    last_cached_day = menu_cache.get_last_date(hall_name)
+    if last_cached_day is not None:
         if last_day is None or last_cached_day > last_day:
             last_day = last_cached_day
     return last_day
 
 
+def create_client(hall_jamix_id):
+    """
+    Create a scraping context for one hall using the configured engine.
+    Every client owns its own connection or browser, so no state is shared between halls being scraped at once.
+    """
+    url = JAMIX_URL % hall_jamix_id
+    if app.config['JAMIX_ENGINE'] == 'selenium':
+        return SeleniumClient(url, nutrition_cache=nutrition_cache)
+    return JamixClient(url, nutrition_cache=nutrition_cache)
+
+
+def get_reverify_horizon():
+    """
+    :return: first and last days that are scraped and ingested again even though they're already covered.
+    """
+    today = datetime.datetime.now(TIMEZONE).date()
+    return today, today + datetime.timedelta(days=app.config['JAMIX_REVERIFY_DAYS'] - 1)
+
+
+def scrape_hall(client, hall_name, stats):
+    """
+    Scrape a hall's menus into the menu cache.
+    When scraping incrementally, days already covered are skipped, except for those in the re-verification horizon.
+    """
+    last_day = get_last_day(hall_name) if app.config['JAMIX_INCREMENTAL'] else None
+    reverified_days = []
+
+    def on_day(day):
+        menu_cache.save_day(hall_name, day)
+        if last_day is not None and datetime.datetime.strptime(day['date'], DATE_FMT_JAMIX).date() <= last_day:
+            reverified_days.append(day['date'])
+
+    if last_day is None:
+        # Nothing covered yet, so go all the way to the start
+        client.seek_start()
+        client.scrape_right(on_day)
+        return
+    horizon_start, horizon_end = get_reverify_horizon()
+    resume = True
+    if horizon_start <= min(horizon_end, last_day):
+        client.seek_date(horizon_start.strftime(DATE_FMT_JAMIX))
+        # If the horizon reaches the first uncovered day, just carry on from there
+        resume = horizon_end < last_day
+        client.scrape_right(on_day, until=horizon_end if resume else None)
+    if resume:
+        # TODO: in theory, if we didn't run the scraper for a really long time, this could take us
+        # back to a time where there's no data, and the parser will think it's finished with this hall.
+        # Hopefully we'll run often enough that this won't happen, but it would be good to be sure.
+        client.seek_date(day_after(last_day))
+        client.scrape_right(on_day)
+    earliest_day = datetime.datetime.strptime(EARLIEST_DATE, DATE_FMT_JAMIX).date()
+    stats['skipped_days'] = (last_day - earliest_day).days + 1 - len(set(reverified_days))
+    stats['reverified_days'] = len(set(reverified_days))
+
+
 def parse(hall_jamix_id):
+    """
+    Scrape a hall, starting over with a fresh client whenever the scrape fails, waiting longer each time.
+    :raises: the last error, once the hall has been restarted JAMIX_MAX_RESTARTS times.
+    """
     finished = False
     stats = {
         'restarts': 0,
+        # Days already covered that weren't scraped again
+        'skipped_days': 0,
+        'reverified_days': 0,
+        # Times the page was brought back to where the scrape was after changing under it, and how many of those
+        # needed a full reload
+        'recoveries': 0,
+        'refreshes': 0,
+        # Round trips to the JAMIX app, by screen for the browser engine and by RPC method otherwise
+        'rpcs': {},
+        # Items whose nutrition facts were already known, so their nutrition panes weren't opened
+        'nutrition_cached': 0,
+        # Time spent waiting on the JAMIX app, by call site
+        'waits': {},
     }
     while not finished:
-        driver.get('https://usa.jamix.cloud/menu/app?anro=97939&k=%d' % hall_jamix_id)
-        sleep()
-        hall_name = get_header_text()
-        hall_name = clean_hall_name(hall_name)
-        if hall_name not in menus:
-            menus[hall_name] = []
-        # If there's already some days in the list, then go to the next day.
-        # Otherwise, go all the way to the start.
-        # TODO: in theory, if we didn't run the scraper for a really long time, this could take us
-        # back to a time where there's no data, and the parser will think it's finished with this hall.
-        # Hopefully we'll run often enough that this won't happen, but it would be good to be sure.
-        last_day = get_last_day(hall_name)
-        if last_day and False:
-            seek_date(day_after(last_day))
-        else:
-            # Uncomment to jump ahead by a few days if we need to look at a future time
-            #seek_date(
-            #    (datetime.date.today() + datetime.timedelta(days=16)).strftime(DATE_FMT_JAMIX)
-            #)
-            seek_start()
-
+        client = create_client(hall_jamix_id)
         try:
-            finished = scrape_right(hall_name)
-        except (ElementClickInterceptedException, ElementNotInteractableException, IndexError) as e:
-            print('Squashing error...')
+            client.connect()
+            hall_name = clean_hall_name(client.get_header_text())
+            scrape_hall(client, hall_name, stats)
+            finished = True
+        except RESTARTED_ERRORS as e:
             print(e)
+            if stats['restarts'] >= app.config['JAMIX_MAX_RESTARTS']:
+                print('Giving up on JAMIX hall %d.' % hall_jamix_id)
+                raise
+            print('Squashing error...')
             stats['restarts'] += 1
-    return hall_name, menus[hall_name], stats
+        finally:
+            client.close()
+            nutrition_cache.save()
+            stats['recoveries'] += client.recoveries
+            stats['refreshes'] += client.refreshes
+            stats['nutrition_cached'] += client.nutrition_hits
+            for screen, count in client.rpcs.items():
+                stats['rpcs'][screen] = stats['rpcs'].get(screen, 0) + count
+            merge_waits(stats['waits'], client.waits)
+        if not finished:
+            # Back off, in case JAMIX is down or struggling
+            time.sleep(app.config['JAMIX_RESTART_DELAY'] * 2 ** (stats['restarts'] - 1))
+    return hall_name, stats
+
+
+def parse_worker(hall_jamix_id):
+    """
+    Scrape one hall from a pool thread, which needs its own application context and database session.
+    """
+    with app.app_context():
+        try:
+            return parse(hall_jamix_id)
+        finally:
+            db.session.remove()
 
 
 def get_last_covered_day(hall):
@@ -735,210 +660,363 @@ def get_last_covered_day(hall):
     return last_meal.date
 
 
-def parse_hall(hall_name):
-    print('Parsing hall ' + hall_name)
-    hall = Hall.query.filter_by(name=hall_name).first()
-    stats = {
-        'found': {
-            'days': 0,
-            'meals': 0,
-            'items': 0,
-        },
-        'inserted': {
-            'meals': 0,
-            'items': 0,
-        },
-        'end_day': None,
-        'days_left': None,
+def get_item_index():
+    """
+    Index all known items for deduplicating scraped ones in memory.
+    :return: dictionary from each item's fingerprint to a list of its ID and whether it contains tree nuts.
+    """
+    return {
+        fingerprint: [item_id, tree_nut]
+        for fingerprint, item_id, tree_nut in db.session.query(Item.fingerprint, Item.id, Item.tree_nut)
     }
-    for day_d in menus[hall_name]:
-        stats['found']['days'] += 1
-        date = datetime.datetime.strptime(day_d['date'], DATE_FMT_JAMIX).date()
+
+
+def get_item(item_name, course_d, items, new_items, stats, corrected):
+    """
+    Find the scraped item in the item index, or queue it to be inserted along with its nutrition facts.
+    :param corrected: fingerprints of existing items whose allergens have been corrected, added to.
+    :return: fingerprint of the item.
+    """
+    # Note that both ingredients and nutrition_d['items'] are dictionaries,
+    # with the keys being the names of the items.
+    ingredients = course_d['ingredients']
+    nutrition_d = course_d['nutrition']
+    course_name = course_d['name']
+    stats['found']['items'] += 1
+    print('Parsing item ' + item_name)
+    clean_item_name = ITEM_NAME_OVERRIDES.get(item_name, item_name).replace('`', '\'')
+    item = Item(
+        name=clean_item_name,
+        ingredients=ingredients[item_name]['ingredients'],
+        course=course_name,
+
+        # Set to default for later operations
+        # Database will put in the default values, but we need
+        # to compare them for deduplication below.
+        alcohol=False,
+        shellfish=False,
+        tree_nut=False,
+        peanuts=False,
+        dairy=False,
+        egg=False,
+        pork=False,
+        fish=False,
+        soy=False,
+        wheat=False,
+        gluten=False,
+        coconut=False,
+
+        nuts=False,
+    )
+    diets = ingredients[item_name]['diets'].split(', ')
+    item.animal_products = not ('VG' in diets)
+    item.meat = not ('V' in diets)
+    item.gluten = not ('GF' in diets)
+    allergens = ingredients[item_name].get('allergens')
+    if allergens:
+        allergens = allergens.split(', ')
+        for allergen in allergens:
+            setattr(item, allergen.lower(), True)
+    item.fingerprint = item.make_fingerprint()
+
+    if item.fingerprint in new_items:
+        new_items[item.fingerprint][0].tree_nut = item.tree_nut
+        return item.fingerprint
+    existing_item = items.get(item.fingerprint)
+    if existing_item is not None:
+        item_id, tree_nut = existing_item
+        if tree_nut != item.tree_nut:
+            # Fix missing tree nut allergens
+            Item.query.filter_by(id=item_id).update({'tree_nut': item.tree_nut})
+            existing_item[1] = item.tree_nut
+            corrected.add(item.fingerprint)
+        return item.fingerprint
+    stats['inserted']['items'] += 1
+    nutrition = None
+    if nutrition_d['items'].get(item_name):
+        # Read nutrition facts
+        # TODO: 'nutrition' or 'nutrition facts'?
+        nutrition = read_nutrition_facts(nutrition_d['items'][item_name])
+    new_items[item.fingerprint] = (item, nutrition)
+    return item.fingerprint
+
+
+def get_meal_fingerprints(meal_d, items, new_items, stats, corrected):
+    """
+    :return: fingerprints of the items in a scraped meal, without duplicates, in order.
+    """
+    fingerprints = []
+    for course_d in meal_d['courses']:
+        print('Parsing course ' + course_d['name'])
+        for item_name in course_d['ingredients']:
+            fingerprint = get_item(item_name, course_d, items, new_items, stats, corrected)
+            if fingerprint not in fingerprints:
+                fingerprints.append(fingerprint)
+    return fingerprints
+
+
+def insert_items(new_items, items):
+    """
+    Bulk insert queued items and their nutrition facts, and add them to the item index.
+    """
+    if not new_items:
+        return
+    bulk_insert(Item.__table__, [to_row(item) for item, nutrition in new_items.values()])
+    fingerprints = list(new_items)
+    for offset in range(0, len(fingerprints), LOOKUP_CHUNK_SIZE):
+        chunk = fingerprints[offset:offset + LOOKUP_CHUNK_SIZE]
+        for fingerprint, item_id in db.session.query(Item.fingerprint, Item.id).filter(Item.fingerprint.in_(chunk)):
+            items[fingerprint] = [item_id, new_items[fingerprint][0].tree_nut]
+    nutrition_rows = []
+    for fingerprint, (item, nutrition) in new_items.items():
+        if nutrition is not None:
+            nutrition.item_id = items[fingerprint][0]
+            nutrition_rows.append(to_row(nutrition))
+    bulk_insert(Nutrition.__table__, nutrition_rows)
+
+
+def get_meal_ids(hall, start_date, end_date):
+    """
+    :return: dictionary from the name and date of each of a hall's meals in the given range to its ID.
+    """
+    meals = db.session.query(Meal.name, Meal.date, Meal.id).filter(Meal.hall_id == hall.id,
+                                                                   Meal.date.between(start_date, end_date))
+    return {(name, date): meal_id for name, date, meal_id in meals}
+
+
+def get_meal_times(meal_name):
+    """
+    :return: start and end times of a meal, where known.
+    """
+    if meal_name == 'Breakfast':
+        start_time = '08:00'
+        end_time = '10:30'
+    elif meal_name == 'Lunch':
+        start_time = '11:30'
+        end_time = '13:30'
+        #end_time = '14:00'
+    elif 'Dinner' in meal_name:
+        start_time = '17:00'
+        end_time = '19:00'
+        #end_time = '19:30'
+    else:
+        start_time = None
+        end_time = None
+    return start_time, end_time
+
+
+def ingest_days(halls, days, items, stats):
+    """
+    Write scraped days of menus to the database in bulk, for each of the halls serving them.
+    Halls sharing a menu get their own meals, but each meal is only parsed once for all of them.
+    Meals already ingested are only rebuilt if they're within the re-verification horizon and have changed.
+    :param items: item index from get_item_index, which is kept up to date with the items inserted.
+    :param stats: ingest statistics of each hall, by ID. Days, meals and items found are counted once for all halls.
+    :return: dictionary from each hall's ID to the dates whose menus were added or changed.
+    """
+    changed_dates = {hall.id: set() for hall in halls}
+    if not days:
+        return changed_dates
+    found_stats = stats[halls[0].id]
+    dates = [datetime.datetime.strptime(day_d['date'], DATE_FMT_JAMIX).date() for day_d in days]
+    existing_meals = {hall.id: get_meal_ids(hall, min(dates), max(dates)) for hall in halls}
+    horizon_start, horizon_end = get_reverify_horizon()
+    # Items found for the first time, by fingerprint, along with their nutrition facts
+    new_items = {}
+    # Fingerprints of existing items whose allergens were corrected
+    corrected = set()
+    # Rows of meals found for the first time, and the fingerprints of their items, by hall ID, name and date
+    new_meals = {}
+    new_meal_fingerprints = {}
+    # Hall IDs, dates and item fingerprints of existing meals being re-verified, by ID
+    reverified_meals = {}
+    for day_d, date in zip(days, dates):
+        found_stats['found']['days'] += 1
         print('Parsing day ' + day_d['date'])
         # TODO: some days may actually have less than three meals.
         if len(day_d['meals']) < MIN_MEALS_ALLOWED:
             print('Not enough meals found, skipping day.')
             continue
         for meal_d in day_d['meals']:
-            stats['found']['meals'] += 1
+            found_stats['found']['meals'] += 1
             meal_name = meal_d['name']
-            existing_meal = Meal.query.filter_by(hall_id=hall.id, name=meal_name, date=date).first()
-            if existing_meal is not None:
-                print('Meal already exists.')
+            # Only parsed once some hall needs it
+            fingerprints = None
+            for hall in halls:
+                meal_id = existing_meals[hall.id].get((meal_name, date))
+                if meal_id is not None:
+                    if not horizon_start <= date <= horizon_end:
+                        print('Meal already exists.')
+                        continue
+                    # The menu may have changed since it was last scraped, so rebuild its items
+                    print('Reverifying meal ' + meal_name)
+                    if fingerprints is None:
+                        fingerprints = get_meal_fingerprints(meal_d, items, new_items, found_stats, corrected)
+                    reverified_meals[meal_id] = (hall.id, date, fingerprints)
+                    continue
+                key = (hall.id, meal_name, date)
+                if key in new_meals:
+                    print('Meal already exists.')
+                    continue
+                print('Parsing meal ' + meal_name)
+                start_time, end_time = get_meal_times(meal_name)
+                new_meals[key] = to_row(Meal(
+                    name=meal_name,
+                    date=date,
+                    start_time=start_time,
+                    end_time=end_time,
+                    hall_id=hall.id,
+                ))
+                if fingerprints is None:
+                    fingerprints = get_meal_fingerprints(meal_d, items, new_items, found_stats, corrected)
+                new_meal_fingerprints[key] = fingerprints
+                stats[hall.id]['inserted']['meals'] += 1
+                changed_dates[hall.id].add(date)
+    for hall in halls[1:]:
+        stats[hall.id]['found'] = dict(found_stats['found'])
+    # Stored menus listing an item whose allergens were corrected have to be serialized again
+    if corrected:
+        meal_fingerprints = [((hall_id, date), fingerprints)
+                             for (hall_id, name, date), fingerprints in new_meal_fingerprints.items()]
+        meal_fingerprints += [((hall_id, date), fingerprints)
+                              for hall_id, date, fingerprints in reverified_meals.values()]
+        for (hall_id, date), fingerprints in meal_fingerprints:
+            if corrected.intersection(fingerprints):
+                changed_dates[hall_id].add(date)
+
+    insert_items(new_items, items)
+    associations = []
+    if reverified_meals:
+        old_item_ids = {meal_id: set() for meal_id in reverified_meals}
+        for meal_id, item_id in db.session.query(meals_x_items.c.meal_id, meals_x_items.c.item_id) \
+                                          .filter(meals_x_items.c.meal_id.in_(reverified_meals)):
+            old_item_ids[meal_id].add(item_id)
+        changed_meal_ids = []
+        for meal_id, (hall_id, date, fingerprints) in reverified_meals.items():
+            item_ids = [items[fingerprint][0] for fingerprint in fingerprints]
+            if set(item_ids) == old_item_ids[meal_id]:
                 continue
-            print('Parsing meal ' + meal_name)
-            if meal_name == 'Breakfast':
-                start_time = '08:00'
-                end_time = '10:30'
-            elif meal_name == 'Lunch':
-                start_time = '11:30'
-                end_time = '13:30'
-                #end_time = '14:00'
-            elif 'Dinner' in meal_name:
-                start_time = '17:00'
-                end_time = '19:00'
-                #end_time = '19:30'
-            else:
-                start_time = None
-                end_time = None
-            meal = Meal(
-                name=meal_name,
-                date=date,
-                start_time=start_time,
-                end_time=end_time,
-            )
-            meal.hall = hall
-            stats['inserted']['meals'] += 1
-            for course_d in meal_d['courses']:
-                course_name = course_d['name']
-                print('Parsing course ' + course_name)
-                # Note that both ingredients and nutrition_d['items'] are dictionaries,
-                # with the keys being the names of the items.
-                ingredients = course_d['ingredients']
-                nutrition_d = course_d['nutrition']
-                for item_name in ingredients:
-                    stats['found']['items'] += 1
-                    print('Parsing item ' + item_name)
-                    clean_item_name = ITEM_NAME_OVERRIDES.get(item_name, item_name).replace('`', '\'')
-                    item = Item(
-                        name=clean_item_name,
-                        ingredients=ingredients[item_name]['ingredients'],
-                        course=course_name,
-
-                        # Set to default for later operations
-                        # Database will put in the default values, but we need
-                        # to compare them for deduplication below.
-                        alcohol=False,
-                        shellfish=False,
-                        tree_nut=False,
-                        peanuts=False,
-                        dairy=False,
-                        egg=False,
-                        pork=False,
-                        fish=False,
-                        soy=False,
-                        wheat=False,
-                        gluten=False,
-                        coconut=False,
-
-                        nuts=False,
-                    )
-                    diets = ingredients[item_name]['diets'].split(', ')
-                    item.animal_products = not ('VG' in diets)
-                    item.meat = not ('V' in diets)
-                    item.gluten = not ('GF' in diets)
-                    allergens = ingredients[item_name].get('allergens')
-                    if allergens:
-                        allergens = allergens.split(', ')
-                        for allergen in allergens:
-                            setattr(item, allergen.lower(), True)
-
-                    # TODO: DRY
-                    existing_item = Item.query.filter_by(
-                        name=item.name,
-                        ingredients=item.ingredients,
-                        course=item.course,
-                        meat=item.meat,
-                        animal_products=item.animal_products,
-                        alcohol=item.alcohol,
-                        shellfish=item.shellfish,
-                        tree_nut=item.tree_nut,
-                        peanuts=item.peanuts,
-                        dairy=item.dairy,
-                        egg=item.egg,
-                        pork=item.pork,
-                        fish=item.fish,
-                        soy=item.soy,
-                        wheat=item.wheat,
-                        gluten=item.gluten,
-                        coconut=item.coconut,
-                    ).first()
-                    if existing_item is None:
-                        # Fix missing tree nut allergens
-                        existing_item = Item.query.filter_by(
-                            name=item.name,
-                            ingredients=item.ingredients,
-                            course=item.course,
-                            meat=item.meat,
-                            animal_products=item.animal_products,
-                            alcohol=item.alcohol,
-                            shellfish=item.shellfish,
-                            tree_nut=not item.tree_nut,
-                            peanuts=item.peanuts,
-                            dairy=item.dairy,
-                            egg=item.egg,
-                            pork=item.pork,
-                            fish=item.fish,
-                            soy=item.soy,
-                            wheat=item.wheat,
-                            gluten=item.gluten,
-                            coconut=item.coconut,
-                        ).first()
-                        if existing_item is not None:
-                            existing_item.tree_nut = item.tree_nut
-                    print(existing_item)
-                    if existing_item is not None:
-                        item = existing_item
-                    else:
-                        stats['inserted']['items'] += 1
-                        db.session.add(item)
-                        if nutrition_d['items'].get(item_name):
-                            # Read nutrition facts
-                            # TODO: 'nutrition' or 'nutrition facts'?
-                            nutrition = read_nutrition_facts(nutrition_d['items'][item_name])
-                            db.session.add(nutrition)
-                            item.nutrition = nutrition
-                    item.meals.append(meal)
-                    # TODO: this should always be present, but handle its absence in case the scraper broke
-            db.session.add(meal)
+            changed_meal_ids.append(meal_id)
+            associations += [{'meal_id': meal_id, 'item_id': item_id} for item_id in item_ids]
+            stats[hall_id]['updated']['meals'] += 1
+            changed_dates[hall_id].add(date)
+        if changed_meal_ids:
+            db.session.execute(meals_x_items.delete().where(meals_x_items.c.meal_id.in_(changed_meal_ids)))
+    if new_meals:
+        bulk_insert(Meal.__table__, list(new_meals.values()))
+        new_dates = [date for hall_id, name, date in new_meals]
+        meal_ids = {
+            (hall.id, name, date): meal_id
+            for hall in halls
+            for (name, date), meal_id in get_meal_ids(hall, min(new_dates), max(new_dates)).items()
+        }
+        for key, fingerprints in new_meal_fingerprints.items():
+            associations += [{'meal_id': meal_ids[key], 'item_id': items[fingerprint][0]} for fingerprint in fingerprints]
+    bulk_insert(meals_x_items, associations)
+    return changed_dates
+
+
+def parse_hall(hall_names, items):
+    """
+    Ingest cached menus into the database.
+    :param hall_names: names of the halls serving the menus; a multi-hall menu is cached under the first one.
+    :param items: item index from get_item_index, which is kept up to date with the items inserted.
+    :return: ingest statistics of each hall, by name.
+    """
+    print('Parsing hall ' + '/'.join(hall_names))
+    halls = [Hall.query.filter_by(name=hall_name).first() for hall_name in hall_names]
+    stats = {
+        hall.id: {
+            'found': {
+                'days': 0,
+                'meals': 0,
+                'items': 0,
+            },
+            'inserted': {
+                'meals': 0,
+                'items': 0,
+            },
+            'updated': {
+                'meals': 0,
+            },
+            'end_day': None,
+            'days_left': None,
+            'materialized_days': 0,
+        }
+        for hall in halls
+    }
+    # Only read the cached days that can still be ingested: those after the last day covered,
+    # and those in the re-verification horizon
+    last_days = [get_last_covered_day(hall) for hall in halls]
+    start_date = None
+    if None not in last_days:
+        start_date = min(get_reverify_horizon()[0], min(last_days) + datetime.timedelta(days=1))
+    changed_dates = ingest_days(halls, menu_cache.load(hall_names[0], start_date), items, stats)
     db.session.commit()
-    stats['end_day'] = get_last_covered_day(hall)
-    return stats
+    dates = menu_cache.get_dates(hall_names[0])
+    for hall in halls:
+        stats[hall.id]['end_day'] = get_last_covered_day(hall)
+        # Serialize each new or changed day's menu now rather than on every request
+        stats[hall.id]['materialized_days'] = materialize_menus(
+            hall.id, changed_dates[hall.id] | get_unmaterialized_dates(hall.id, dates))
+    # Only once the stored menus are up to date, or clients could revalidate old ones under the new generation
+    if any(changed_dates.values()):
+        bump_generation('meals', 'items')
+    return {hall_name: stats[hall.id] for hall_name, hall in zip(hall_names, halls)}
 
 
 def scrape_jamix():
+    import_menu_file()
     print('Reading JAMIX menu data.')
-    create_driver()
+    pool_size = app.config['JAMIX_POOL_SIZE']
     stats = {
         'start_time': datetime.datetime.now(),
         'end_time': None,
+        'pool_size': pool_size,
         'halls': {},
+        # Errors of the halls given up on, by JAMIX ID
+        'failed': {},
     }
 
-    # Iterate through halls
-    for hall_jamix_id in range(1, 11 + 1):
-        # Skip disabled halls
-        if hall_jamix_id in (4,):
-            continue
-        hall_name, hall, scrape_stats = parse(hall_jamix_id)
-        # Separate multi-hall menus
-        # TODO: should we do this at request time?
-        if '/' in hall_name or ' & ' in hall_name or ' and ' in hall_name:
-            value = menus.pop(hall_name)
-            # TODO: just use regex
-            if '/' in hall_name:
-                hall_name_a, hall_name_b = hall_name.split('/')
-            elif ' & ' in hall_name:
-                hall_name_a, hall_name_b = hall_name.split(' & ')
-            elif ' and ' in hall_name:
-                hall_name_a, hall_name_b = hall_name.split(' and ')
-            hall_name_a = clean_hall_name(hall_name_a)
-            hall_name_b = clean_hall_name(hall_name_b)
-            menus[hall_name_a] = value
-            menus[hall_name_b] = value
-            stats['halls'][hall_name_a] = {
-                **scrape_stats,
-                **parse_hall(hall_name_a),
-            }
-            stats['halls'][hall_name_b] = {
-                **scrape_stats,
-                **parse_hall(hall_name_b),
-            }
-        else:
-            stats['halls'][hall_name] = {
-                **scrape_stats,
-                **parse_hall(hall_name),
-            }
+    # Deduplicate scraped items against every known item without querying for each of them
+    items = get_item_index()
+    # Scrape halls concurrently, each in its own session, and ingest them one by one as they finish
+    with ThreadPoolExecutor(max_workers=pool_size) as pool:
+        futures = {
+            pool.submit(parse_worker, hall_jamix_id): hall_jamix_id
+            for hall_jamix_id in range(1, 11 + 1)
+            # Skip disabled halls
+            if hall_jamix_id not in (4,)
+        }
+        for future in as_completed(futures):
+            try:
+                hall_name, scrape_stats = future.result()
+            except RESTARTED_ERRORS as e:
+                # Still ingest and report on the other halls; days cached before the failure are picked up next time
+                stats['failed'][futures[future]] = repr(e)
+                continue
+            # Separate multi-hall menus
+            # TODO: should we do this at request time?
+            if '/' in hall_name or ' & ' in hall_name or ' and ' in hall_name:
+                # TODO: just use regex
+                if '/' in hall_name:
+                    hall_name_a, hall_name_b = hall_name.split('/')
+                elif ' & ' in hall_name:
+                    hall_name_a, hall_name_b = hall_name.split(' & ')
+                elif ' and ' in hall_name:
+                    hall_name_a, hall_name_b = hall_name.split(' and ')
+                hall_name_a = clean_hall_name(hall_name_a)
+                hall_name_b = clean_hall_name(hall_name_b)
+                # The menu is cached under the first hall, and ingested once for both
+                menu_cache.move(hall_name, hall_name_a)
+                hall_names = [hall_name_a, hall_name_b]
+            else:
+                hall_names = [hall_name]
+            for hall_name, hall_stats in parse_hall(hall_names, items).items():
+                stats['halls'][hall_name] = {
+                    **scrape_stats,
+                    **hall_stats,
+                }
 
     now = datetime.datetime.now()
     for hall_name in stats['halls']:
@@ -0,0 +1,65 @@
+from app import db
+from app.models import Meal, Item, Nutrition, Menu
+from app.util import dumps, date_to_string
+from app.compression import compress_all
+
+
+def build_menu(hall_id, date, meals):
+    return {
+        'hall_id': hall_id,
+        'date': date_to_string(date),
+        'meals': [
+            {
+                **Meal.__serializer__(meal),
+                'items': [
+                    {
+                        **Item.__serializer__(item),
+                        'nutrition': Nutrition.__serializer__(item.nutrition) if item.nutrition else None,
+                    }
+                    for item in sorted(meal.items, key=lambda item: item.id)
+                ],
+            }
+            for meal in meals
+        ],
+    }
+
+
+def materialize_menus(hall_id, dates):
+    """
+    Serialize and store the full menu of a hall on each of the given dates, so it can be served without joins.
+    Meals, items, and nutrition for all dates are loaded in a fixed number of queries.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+    meals = Meal.query.filter(Meal.hall_id == hall_id,
+                              Meal.date.in_(dates)) \
+                      .options(db.selectinload(Meal.items).selectinload(Item.nutrition)) \
+                      .order_by(*Meal.__keyset__) \
+                      .all()
+    meals_by_date = {date: [] for date in dates}
+    for meal in meals:
+        meals_by_date[meal.date].append(meal)
+    materialized = 0
+    for date, day_meals in meals_by_date.items():
+        if not day_meals:
+            continue
+        body = dumps(build_menu(hall_id, date, day_meals))
+        if isinstance(body, str):
+            body = body.encode()
+        variants = compress_all(body)
+        db.session.merge(Menu(hall_id=hall_id, date=date, body=body,
+                              body_gzip=variants.get('gzip'),
+                              body_br=variants.get('br')))
+        materialized += 1
+    db.session.commit()
+    return materialized
+
+
+def get_unmaterialized_dates(hall_id, dates):
+    """
+    Filter dates down to those that don't have a stored menu yet.
+    """
+    materialized = {date for date, in db.session.query(Menu.date).filter(Menu.hall_id == hall_id,
+                                                                         Menu.date.in_(set(dates)))}
+    return {date for date in dates if date not in materialized}
@@ -1,39 +1,137 @@
-from flask import jsonify
-from sqlalchemy.ext.declarative import DeclarativeMeta
+from app import app, db
+from flask import Response, stream_with_context
+from sqlalchemy import Date
 
-import datetime
 import json
+import pytz
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 DATE_FMT = '%Y-%m-%d'
+# Local time of the dining halls, which decides what day it is
+TIMEZONE = pytz.timezone('America/New_York')
+# Number of rows fetched from the cursor and encoded at a time when streaming
+STREAM_CHUNK_SIZE = 1000
+
+JSON_BACKENDS = {
+    'json': json.dumps,
+}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = orjson.dumps
+# Fall back to the standard library if the requested backend isn't installed
+dumps = JSON_BACKENDS.get(app.config['JSON_BACKEND'], json.dumps)
+
+
+def date_to_string(val):
+    if val is None:
+        return None
+    return val.strftime(DATE_FMT)
+
+
+def compile_serializer(model):
+    """
+    Generate a function turning an instance of the given model into a dict of its __serializable__ fields.
+    The function is built once from source, so serializing a row is a single dict literal with plain attribute
+    reads rather than a reflective loop.
+    """
+    columns = model.__table__.columns
+    values = []
+    for field in model.__serializable__:
+        if isinstance(columns[field].type, Date):
+            values.append(f'{field!r}: date_to_string(obj.{field})')
+        else:
+            values.append(f'{field!r}: obj.{field}')
+    source = 'def serialize(obj):\n    return {%s}\n' % ', '.join(values)
+    namespace = {'date_to_string': date_to_string}
+    exec(compile(source, f'<serializer {model.__name__}>', 'exec'), namespace)
+    return namespace['serialize']
+
 
+def compile_row_serializer(model):
+    """
+    Generate a function turning a row of the model's __serializable__ columns, in order, into a dict.
+    """
+    columns = model.__table__.columns
+    values = []
+    for index, field in enumerate(model.__serializable__):
+        if isinstance(columns[field].type, Date):
+            values.append(f'{field!r}: date_to_string(row[{index}])')
+        else:
+            values.append(f'{field!r}: row[{index}]')
+    source = 'def serialize_row(row):\n    return {%s}\n' % ', '.join(values)
+    namespace = {'date_to_string': date_to_string}
+    exec(compile(source, f'<row serializer {model.__name__}>', 'exec'), namespace)
+    return namespace['serialize_row']
 
-class ModelEncoder(json.JSONEncoder):
-    def val_to_string(self, val):
-        if type(val) == datetime.date:
-            return val.strftime(DATE_FMT)
-        return val
 
-    def default(self, obj):
-        if isinstance(obj.__class__, DeclarativeMeta):
-            # go through each field in this SQLalchemy class
-            fields = {}
-            for field in obj.__class__.__serializable__:
-                val = obj.__getattribute__(field)
+def serializable(model):
+    """
+    Class decorator attaching compiled serializers for instances and for plain column rows to a model.
+    """
+    model.__serializer__ = compile_serializer(model)
+    model.__row_serializer__ = compile_row_serializer(model)
+    model.__projection__ = tuple(getattr(model, field) for field in model.__serializable__)
+    return model
 
-                # is this field another SQLalchemy object, or a list of SQLalchemy objects?
-                if isinstance(val.__class__, DeclarativeMeta) or (isinstance(val, list) and len(val) > 0 and isinstance(val[0].__class__, DeclarativeMeta)):
-                    # unless we're expanding this field, stop here
-                    if field not in obj.__class__._to_expand:
-                        # not expanding this field: set it to None and continue
-                        fields[field] = None
-                        continue
-                fields[field] = self.val_to_string(val)
-            # a json-encodable dict
-            return fields
 
-        return json.JSONEncoder.default(self, obj)
+def fetch_rows(query, model):
+    """
+    Run a query selecting only the model's __serializable__ columns.
+    Rows come back as plain tuples and are turned straight into dicts, so no ORM objects are built
+    and nothing is added to the session's identity map.
+    """
+    serialize_row = model.__row_serializer__
+    result = db.session.execute(query.with_entities(*model.__projection__).statement)
+    return [serialize_row(row) for row in result]
+
+
+def serialize(obj):
+    if isinstance(obj, list):
+        if not obj:
+            return obj
+        # Bulk path: look up the serializer once for the whole list
+        serializer = getattr(obj[0].__class__, '__serializer__', None)
+        if serializer is None:
+            return obj
+        return [serializer(row) for row in obj]
+    serializer = getattr(obj.__class__, '__serializer__', None)
+    if serializer is None:
+        return obj
+    return serializer(obj)
 
 
 def to_json(model):
-    return json.dumps(model, cls=ModelEncoder)
+    return dumps(serialize(model))
+
+
+def stream_rows(query, model):
+    """
+    Stream the model's __serializable__ columns for a query as a JSON array.
+    Rows are read from a server-side cursor and encoded a chunk at a time, so memory use doesn't grow with
+    the size of the table and the first bytes go out as soon as the first chunk is fetched.
+    """
+    serialize_row = model.__row_serializer__
+    statement = query.with_entities(*model.__projection__).statement.execution_options(stream_results=True)
+
+    def generate():
+        result = db.session.execute(statement)
+        yield '['
+        first = True
+        while True:
+            rows = result.fetchmany(STREAM_CHUNK_SIZE)
+            if not rows:
+                break
+            # Encode the whole chunk at once and drop the surrounding brackets
+            chunk = dumps([serialize_row(row) for row in rows])[1:-1]
+            if not first:
+                yield ','
+            yield chunk
+            first = False
+        result.close()
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
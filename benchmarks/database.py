@@ -0,0 +1,18 @@
+"""
+Database setup shared by the benchmarks that seed their own tables.
+"""
+import os
+import sys
+
+
+def use_benchmark_database():
+    """
+    Point the app at BENCHMARK_DATABASE_URL, which has to be imported before the app to take effect.
+    Benchmarks drop every table, so they refuse to run against anything else, whatever DATABASE_URL says.
+    """
+    url = os.environ.get('BENCHMARK_DATABASE_URL')
+    if not url:
+        sys.exit('Set BENCHMARK_DATABASE_URL to a disposable database; benchmarks drop all of its tables.')
+    if url == os.environ.get('DATABASE_URL'):
+        sys.exit('BENCHMARK_DATABASE_URL is the same as DATABASE_URL; use a database set aside for benchmarks.')
+    os.environ['DATABASE_URL'] = url
@@ -0,0 +1,146 @@
+"""
+Compare the time taken to ingest a hall's scraped menus with the old per-row ORM path and the bulk path used by
+parse_hall, and a multi-hall menu ingested for each hall separately and once for both.
+Each run starts from empty tables, which are dropped, so it only runs against BENCHMARK_DATABASE_URL:
+
+    ADMIN_EMAILS=you@example.com BENCHMARK_DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.ingest [days]
+"""
+from benchmarks.database import use_benchmark_database
+use_benchmark_database()
+
+from app import app, db
+from app.models import Hall, Meal, Item
+from app.scraper import DATE_FMT_JAMIX, get_item_index, ingest_days, read_nutrition_facts
+
+import contextlib
+import datetime
+import io
+import sys
+import time
+
+MEALS = ('Breakfast', 'Lunch', 'Dinner')
+COURSES = ('Entree', 'Soup', 'Dessert', 'Salad Bar')
+ITEMS_PER_COURSE = 8
+# Distinct items per course, so that menus repeat items like the real ones do
+ITEM_VARIETY = 60
+
+
+def make_days(count):
+    start = datetime.date.today() - datetime.timedelta(days=count)
+    days = []
+    for day in range(count):
+        meals = []
+        for meal_index, meal_name in enumerate(MEALS):
+            courses = []
+            for course_name in COURSES:
+                names = ['%s %d' % (course_name, (day * 7 + meal_index * 11 + i) % ITEM_VARIETY)
+                         for i in range(ITEMS_PER_COURSE)]
+                courses.append({
+                    'name': course_name,
+                    'ingredients': {
+                        name: {'diets': 'V, GF' if len(name) % 2 else 'VG', 'ingredients': 'water, salt, ' + name,
+                               'allergens': 'Soy' if len(name) % 3 else None}
+                        for name in names
+                    },
+                    'nutrition': {
+                        'items': {
+                            name: {'Serving Size': '1 cup', 'Calories': {'amount': 210},
+                                   'Total Fat': {'amount': '7.4 g', 'percent_daily_value': 9}}
+                            for name in names
+                        },
+                    },
+                })
+            meals.append({'name': meal_name, 'courses': courses})
+        days.append({'date': (start + datetime.timedelta(days=day)).strftime(DATE_FMT_JAMIX), 'meals': meals})
+    return days
+
+
+def ingest_days_orm(hall, days, items, stats):
+    # Per-row ORM ingest previously done by parse_hall, kept here as the baseline
+    for day_d in days:
+        date = datetime.datetime.strptime(day_d['date'], DATE_FMT_JAMIX).date()
+        for meal_d in day_d['meals']:
+            if Meal.query.filter_by(hall_id=hall.id, name=meal_d['name'], date=date).first() is not None:
+                continue
+            meal = Meal(name=meal_d['name'], date=date)
+            meal.hall = hall
+            for course_d in meal_d['courses']:
+                for item_name, ingredients in course_d['ingredients'].items():
+                    diets = ingredients['diets'].split(', ')
+                    fields = {
+                        'name': item_name, 'ingredients': ingredients['ingredients'], 'course': course_d['name'],
+                        'meat': 'V' not in diets, 'animal_products': 'VG' not in diets, 'gluten': 'GF' not in diets,
+                        'alcohol': False, 'shellfish': False, 'tree_nut': False, 'peanuts': False, 'dairy': False,
+                        'egg': False, 'pork': False, 'fish': False, 'soy': False, 'wheat': False, 'coconut': False,
+                    }
+                    for allergen in (ingredients['allergens'] or '').split(', '):
+                        if allergen:
+                            fields[allergen.lower()] = True
+                    item = Item.query.filter_by(**fields).first()
+                    if item is None:
+                        # Fix missing tree nut allergens
+                        item = Item.query.filter_by(**{**fields, 'tree_nut': not fields['tree_nut']}).first()
+                    if item is None:
+                        item = Item(**fields)
+                        db.session.add(item)
+                        nutrition = read_nutrition_facts(dict(course_d['nutrition']['items'][item_name]))
+                        db.session.add(nutrition)
+                        item.nutrition = nutrition
+                    item.meals.append(meal)
+            db.session.add(meal)
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    for hall_id in ('ES', 'MC'):
+        db.session.add(Hall(id=hall_id, name=hall_id, nickname=hall_id, open=False, occupancy=0,
+                            latitude=0, longitude=0, address='', phone=''))
+    db.session.commit()
+
+
+def ingest_orm(hall_ids, days, items, stats):
+    for hall_id in hall_ids:
+        ingest_days_orm(Hall.query.get(hall_id), days, items, stats[hall_id])
+
+
+def ingest_separately(hall_ids, days, items, stats):
+    for hall_id in hall_ids:
+        ingest_days([Hall.query.get(hall_id)], days, items, stats)
+
+
+def ingest_shared(hall_ids, days, items, stats):
+    ingest_days([Hall.query.get(hall_id) for hall_id in hall_ids], days, items, stats)
+
+
+def measure(name, ingest, days, hall_ids):
+    seed()
+    stats = {
+        hall_id: {'found': {'days': 0, 'meals': 0, 'items': 0}, 'inserted': {'meals': 0, 'items': 0}, 'updated': {'meals': 0}}
+        for hall_id in hall_ids
+    }
+    start = time.perf_counter()
+    # Keep the scraper's progress output out of the way
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest(hall_ids, days, get_item_index(), stats)
+        db.session.commit()
+    elapsed = time.perf_counter() - start
+    rows = sum(db.session.query(table).count() for table in db.metadata.sorted_tables)
+    print(f'{name:9} {elapsed:8.2f} s  {Meal.query.count():,} meals  {Item.query.count():,} items  {rows:,} rows')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    days = make_days(count)
+    with app.app_context():
+        print(f'Ingesting {count} days of one hall.')
+        measure('orm', ingest_orm, days, ['ES'])
+        measure('bulk', ingest_separately, days, ['ES'])
+        print(f'Ingesting {count} days of a menu shared by two halls.')
+        measure('orm', ingest_orm, days, ['ES', 'MC'])
+        measure('separate', ingest_separately, days, ['ES', 'MC'])
+        measure('shared', ingest_shared, days, ['ES', 'MC'])
+
+
+if __name__ == '__main__':
+    main()
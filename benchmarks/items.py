@@ -0,0 +1,56 @@
+"""
+Compare the ORM read path against the column-projected read path used by /items.
+Seeds a throwaway database, dropping its tables, so it only runs against BENCHMARK_DATABASE_URL:
+
+    ADMIN_EMAILS=you@example.com BENCHMARK_DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.items
+"""
+from benchmarks.database import use_benchmark_database
+use_benchmark_database()
+
+from app import app, db
+from app.models import Item
+from app.util import to_json, fetch_rows
+
+import time
+import tracemalloc
+
+ROWS = 50000
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(Item, [
+        {
+            'name': 'Item %d' % i,
+            'ingredients': 'flour, water, salt, yeast',
+            'course': 'Entree',
+            'dairy': bool(i % 2),
+            'wheat': True,
+            'gluten': True,
+        }
+        for i in range(ROWS)
+    ])
+    db.session.commit()
+
+
+def measure(name, read):
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+    body = to_json(read())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:10} {ROWS / elapsed:12,.0f} rows/s  peak {peak / 2 ** 20:7.1f} MiB  ({len(body):,} bytes)')
+
+
+def main():
+    with app.app_context():
+        seed()
+        measure('orm', lambda: Item.query.all())
+        measure('projected', lambda: fetch_rows(Item.query, Item))
+
+
+if __name__ == '__main__':
+    main()
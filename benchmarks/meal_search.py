@@ -0,0 +1,96 @@
+"""
+Seed years of synthetic meals and report Meal.search latency and query plans with and without the meal indexes.
+Works against SQLite or Postgres. Its tables are dropped, so it only runs against BENCHMARK_DATABASE_URL:
+
+    ADMIN_EMAILS=you@example.com BENCHMARK_DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.meal_search [years]
+"""
+from benchmarks.database import use_benchmark_database
+use_benchmark_database()
+
+from app import app, db
+from app.models import Hall, Meal, Item, meals_x_items
+
+import datetime
+import sys
+import time
+
+HALL_IDS = ('BK', 'BR', 'DC', 'BF', 'GH', 'JE', 'MC', 'MY', 'PC', 'SY', 'SM', 'ES', 'TD', 'TC')
+MEALS = (('Breakfast', '08:00', '10:30'), ('Lunch', '11:30', '13:30'), ('Dinner', '17:00', '19:00'))
+ITEMS = 2000
+ITEMS_PER_MEAL = 12
+REPEAT = 20
+
+
+def seed(years):
+    db.drop_all()
+    db.create_all()
+    db.session.bulk_insert_mappings(Hall, [
+        {'id': hall_id, 'name': hall_id, 'nickname': hall_id, 'open': False, 'occupancy': 0,
+         'latitude': 0, 'longitude': 0, 'address': '', 'phone': ''}
+        for hall_id in HALL_IDS
+    ])
+    db.session.bulk_insert_mappings(Item, [{'name': 'Item %d' % i, 'course': 'Entree'} for i in range(ITEMS)])
+    start = datetime.date.today() - datetime.timedelta(days=365 * years)
+    meals = []
+    for day in range(365 * years):
+        for hall_id in HALL_IDS:
+            for name, start_time, end_time in MEALS:
+                meals.append({'name': name, 'date': start + datetime.timedelta(days=day),
+                              'start_time': start_time, 'end_time': end_time, 'hall_id': hall_id})
+    db.session.bulk_insert_mappings(Meal, meals)
+    meal_ids = [meal_id for meal_id, in db.session.query(Meal.id)]
+    db.session.execute(meals_x_items.insert(), [
+        {'meal_id': meal_id, 'item_id': (meal_id * 7 + i * 13) % ITEMS + 1}
+        for meal_id in meal_ids
+        for i in range(ITEMS_PER_MEAL)
+    ])
+    db.session.commit()
+    print(f'Seeded {len(meal_ids):,} meals and {len(meal_ids) * ITEMS_PER_MEAL:,} associations.')
+
+
+def explain(statement):
+    compiled = statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' '.join(str(column) for column in row) for row in db.session.execute(db.text(prefix + str(compiled)))]
+
+
+def cases():
+    today = datetime.date.today()
+    return {
+        'hall, date': Meal.search_query(hall_id='TD', date=today),
+        'hall, range': Meal.search_query(hall_id='TD', start_date=today - datetime.timedelta(days=7), end_date=today),
+        'all halls, date': Meal.search_query(date=today),
+        'meal items': Item.query.join(meals_x_items).filter(meals_x_items.c.meal_id == 1000),
+        'item meals': Meal.query.join(meals_x_items).filter(meals_x_items.c.item_id == 1000),
+    }
+
+
+def measure(label):
+    print(f'\n{label}')
+    for name, query in cases().items():
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            query.all()
+            db.session.expunge_all()
+        elapsed = (time.perf_counter() - start) / REPEAT
+        print(f'  {name:16} {elapsed * 1000:9.2f} ms')
+        for line in explain(query.statement):
+            print(f'      {line}')
+
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with app.app_context():
+        seed(years)
+        indexes = list(Meal.__table__.indexes) + list(meals_x_items.indexes)
+        for index in indexes:
+            index.drop(db.engine)
+        measure('Without indexes')
+        for index in indexes:
+            index.create(db.engine)
+        db.session.execute(db.text('ANALYZE'))
+        measure('With indexes')
+
+
+if __name__ == '__main__':
+    main()
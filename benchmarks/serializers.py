@@ -0,0 +1,83 @@
+"""
+Compare rows serialized per second by the old reflective ModelEncoder and the compiled per-model serializers.
+
+    ADMIN_EMAILS=you@example.com python -m benchmarks.serializers
+"""
+from app.models import Meal, Item
+from app.util import JSON_BACKENDS, serialize
+from sqlalchemy.ext.declarative import DeclarativeMeta
+
+import datetime
+import json
+import time
+
+ROWS = 20000
+REPEAT = 5
+
+
+class ModelEncoder(json.JSONEncoder):
+    # Reflective encoder previously used by to_json, kept here as the baseline
+    def val_to_string(self, val):
+        if type(val) is datetime.date:
+            return val.strftime('%Y-%m-%d')
+        return val
+
+    def default(self, obj):
+        if isinstance(obj.__class__, DeclarativeMeta):
+            fields = {}
+            for field in obj.__class__.__serializable__:
+                val = obj.__getattribute__(field)
+                if isinstance(val.__class__, DeclarativeMeta) or (isinstance(val, list) and len(val) > 0 and isinstance(val[0].__class__, DeclarativeMeta)):
+                    if field not in obj.__class__._to_expand:
+                        fields[field] = None
+                        continue
+                fields[field] = self.val_to_string(val)
+            return fields
+        return json.JSONEncoder.default(self, obj)
+
+
+def make_rows():
+    items = [
+        Item(id=i, name='Item %d' % i, ingredients='flour, water, salt', course='Entree',
+             meat=False, animal_products=True, alcohol=False, tree_nut=False, shellfish=False,
+             peanuts=False, dairy=True, egg=False, pork=False, fish=False, soy=False,
+             wheat=True, gluten=True, coconut=False, meal_id=0, nuts=False)
+        for i in range(ROWS)
+    ]
+    meals = [
+        Meal(id=i, name='Lunch', date=datetime.date(2021, 1, 1) + datetime.timedelta(days=i % 365),
+             start_time='11:30', end_time='13:30', hall_id='BK')
+        for i in range(ROWS)
+    ]
+    return items, meals
+
+
+def measure(encode, rows):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        encode(rows)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(rows) / best
+
+
+def main():
+    items, meals = make_rows()
+    encoders = {
+        'reflective (json)': lambda rows: json.dumps(rows, cls=ModelEncoder),
+    }
+    for name, backend in JSON_BACKENDS.items():
+        encoders[f'compiled ({name})'] = lambda rows, backend=backend: backend(serialize(rows))
+    for label, rows in (('Item', items), ('Meal', meals)):
+        baseline = None
+        for name, encode in encoders.items():
+            rate = measure(encode, rows)
+            if baseline is None:
+                baseline = rate
+            print(f'{label:5} {name:20} {rate:12,.0f} rows/s  {rate / baseline:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
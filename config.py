@@ -8,10 +8,41 @@ class Config(object):
                                              'sqlite:///' + os.path.join(basedir, 'app.db')).replace('postgres://', 'postgresql://')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    CELERY_BROKER_URL = CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    REDIS_URL = CELERY_BROKER_URL = CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    # Seconds Redis is given to accept a connection and to answer a command before requests fall back to the database
+    REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 1))
+    REDIS_TIMEOUT = float(os.environ.get('REDIS_TIMEOUT', 2))
 
     FALLBACK_HALL_ID = os.environ.get('FALLBACK_HALL_ID')
 
+    # Menus are scraped by driving Chrome, or by speaking to the JAMIX app over plain HTTP if set to 'http'.
+    # The HTTP engine is only tested against fixtures in tests/fixtures/jamix until some are recorded from the live app
+    JAMIX_ENGINE = os.environ.get('JAMIX_ENGINE', 'selenium')
+    # Can be pointed at a local stand-in server for testing
+    JAMIX_URL = os.environ.get('JAMIX_URL', 'https://usa.jamix.cloud/menu/app')
+    # Number of halls scraped at once, each in its own session or browser
+    JAMIX_POOL_SIZE = int(os.environ.get('JAMIX_POOL_SIZE', 4))
+    # Only scrape days after the last one already covered, unless set to 'false'
+    JAMIX_INCREMENTAL = os.environ.get('JAMIX_INCREMENTAL', 'true').lower() != 'false'
+    # Number of days from today that are scraped again even if already covered, as their menus may still change
+    JAMIX_REVERIFY_DAYS = int(os.environ.get('JAMIX_REVERIFY_DAYS', 3))
+    # Times a hall's scrape is started over after failing before the hall is given up on for this run
+    JAMIX_MAX_RESTARTS = int(os.environ.get('JAMIX_MAX_RESTARTS', 5))
+    # Seconds waited before the first restart, doubling with each one after
+    JAMIX_RESTART_DELAY = float(os.environ.get('JAMIX_RESTART_DELAY', 5))
+
+    # Hall pages listing managers are fetched from here; can be pointed at a local stand-in server for testing
+    MANAGERS_URL = os.environ.get('MANAGERS_URL', 'https://hospitality.yale.edu/residential-dining/')
+    # Number of hall pages fetched at once
+    MANAGERS_POOL_SIZE = int(os.environ.get('MANAGERS_POOL_SIZE', 4))
+
+    # Encoder used for API responses; falls back to the standard library json module if unavailable
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson')
+    # Requests to the API issuing more queries than this are logged, and fail outright when testing
+    MAX_QUERIES_PER_REQUEST = int(os.environ.get('MAX_QUERIES_PER_REQUEST', 5))
+    # Seconds API responses are kept in the Redis cache, unless the scraper changes their data first
+    CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', 60 * 60))
+
     # Email sending with Gmail
     MAIL_SERVER = 'smtp.googlemail.com'
     MAIL_PORT = 465
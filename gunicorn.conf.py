@@ -0,0 +1,11 @@
+# Requests are served from greenlets rather than threads, so that the long-lived /halls/stream connections
+# each cost a greenlet and a queue instead of holding one of a fixed number of request threads
+worker_class = 'gevent'
+# Open connections per worker, streams included
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    # Let other greenlets run while one waits on Postgres
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
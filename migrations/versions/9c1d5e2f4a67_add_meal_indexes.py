@@ -0,0 +1,30 @@
+"""add meal indexes
+
+Revision ID: 9c1d5e2f4a67
+Revises: 71e3a1e85acb
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1d5e2f4a67'
+down_revision = '71e3a1e85acb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_meals_keyset', 'meals', ['hall_id', 'date', sa.text("coalesce(start_time, '')"), 'id'], unique=False)
+    op.create_index('ix_meals_date', 'meals', ['date'], unique=False)
+    op.create_index('ix_meals_x_items_meal_id_item_id', 'meals_x_items', ['meal_id', 'item_id'], unique=False)
+    op.create_index('ix_meals_x_items_item_id_meal_id', 'meals_x_items', ['item_id', 'meal_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_meals_x_items_item_id_meal_id', table_name='meals_x_items')
+    op.drop_index('ix_meals_x_items_meal_id_item_id', table_name='meals_x_items')
+    op.drop_index('ix_meals_date', table_name='meals')
+    op.drop_index('ix_meals_keyset', table_name='meals')
@@ -0,0 +1,84 @@
+"""add item fingerprints
+
+Revision ID: e5b27f9c03d1
+Revises: d8a3c6b15e90
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import hashlib
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b27f9c03d1'
+down_revision = 'd8a3c6b15e90'
+branch_labels = None
+depends_on = None
+
+# Copied from Item.__fingerprinted__ as of this revision, so the backfill doesn't change along with the model
+TEXT_FIELDS = ('name', 'ingredients', 'course')
+FLAG_FIELDS = ('meat', 'animal_products', 'alcohol', 'shellfish', 'peanuts', 'dairy', 'egg', 'pork', 'fish', 'soy', 'wheat', 'gluten', 'coconut')
+
+items = sa.table(
+    'items',
+    sa.column('id', sa.Integer),
+    sa.column('fingerprint', sa.String),
+    sa.column('tree_nut', sa.Boolean),
+    *(sa.column(field, sa.String) for field in TEXT_FIELDS),
+    *(sa.column(field, sa.Boolean) for field in FLAG_FIELDS),
+)
+meals_x_items = sa.table(
+    'meals_x_items',
+    sa.column('meal_id', sa.Integer),
+    sa.column('item_id', sa.Integer),
+)
+nutrition = sa.table(
+    'nutrition',
+    sa.column('item_id', sa.Integer),
+)
+
+
+def make_fingerprint(row):
+    values = [row[field] for field in TEXT_FIELDS] + [bool(row[field]) for field in FLAG_FIELDS]
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+def upgrade():
+    op.add_column('items', sa.Column('fingerprint', sa.String(length=40), nullable=True))
+
+    # Backfill fingerprints. Items that turn out to be duplicates, which the scraper's queries could let through
+    # (e.g. differing only in tree_nut), are merged into the oldest one so the fingerprint can be unique.
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([items]).order_by(items.c.id)).fetchall()
+    canonical = {}
+    fingerprints = []
+    for row in rows:
+        fingerprint = make_fingerprint(row)
+        if fingerprint not in canonical:
+            canonical[fingerprint] = row
+            fingerprints.append({'item_id': row['id'], 'new_fingerprint': fingerprint})
+            continue
+        original = canonical[fingerprint]
+        # Don't link meals to the original twice
+        original_meals = sa.select([meals_x_items.c.meal_id]).where(meals_x_items.c.item_id == original['id'])
+        connection.execute(meals_x_items.delete().where(meals_x_items.c.item_id == row['id']).where(meals_x_items.c.meal_id.in_(original_meals)))
+        connection.execute(meals_x_items.update().where(meals_x_items.c.item_id == row['id']).values(item_id=original['id']))
+        connection.execute(nutrition.delete().where(nutrition.c.item_id == row['id']))
+        connection.execute(items.delete().where(items.c.id == row['id']))
+        if row['tree_nut'] and not original['tree_nut']:
+            connection.execute(items.update().where(items.c.id == original['id']).values(tree_nut=True))
+    if fingerprints:
+        connection.execute(
+            items.update().where(items.c.id == sa.bindparam('item_id')).values(fingerprint=sa.bindparam('new_fingerprint')),
+            fingerprints,
+        )
+
+    op.create_index(op.f('ix_items_fingerprint'), 'items', ['fingerprint'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_items_fingerprint'), table_name='items')
+    op.drop_column('items', 'fingerprint')
@@ -2,4 +2,4 @@
 # E501 Line too long
 # E402 Import not at top of file
 # E265 block comment should start with '# '
-pycodestyle *.py app/*.py --ignore=E501,E402,E265
+pycodestyle *.py app/*.py benchmarks/*.py --ignore=E501,E402,E265
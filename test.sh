@@ -1,2 +1,3 @@
 #!/usr/bin/env bash
 ./style_test.sh
+python -m pytest -q tests
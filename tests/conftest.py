@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+# The app is configured from the environment when it's imported, so point it at a throwaway database,
+# and at a Redis nothing listens on so that every response is rendered from the database
+os.environ.setdefault('ADMIN_EMAILS', 'test@example.com')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['REDIS_URL'] = 'redis://localhost:1/0'
+
+import pytest
+from sqlalchemy import event
+
+from app import app as flask_app, db
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+
+@pytest.fixture
+def writes(app):
+    """
+    Statements changing the database, as they're run.
+    """
+    writes = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            writes.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield writes
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,144 @@
+"""
+Record exchanges with the JAMIX app, and replay them from a local stand-in server.
+
+Fixtures are recorded by walking a hall's menus with the HTTP engine through a recording session:
+
+    ADMIN_EMAILS=you@example.com python -m tests.jamix_standin 'https://usa.jamix.cloud/menu/app?anro=97939&k=1' tests/fixtures/jamix/hall.json
+
+The stand-in answers each request with the next recorded response, after checking that it's the request
+that was recorded, so a client replaying a fixture has to make exactly the same RPC calls as it did live.
+"""
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+from app.jamix import JamixClient, NutritionCache
+
+import datetime
+import json
+import requests
+import sys
+import threading
+from urllib.parse import urlsplit
+
+# Stands in for the origin of the JAMIX app in recorded URLs and bodies, and is swapped for the stand-in's own
+ORIGIN = 'https://jamix.invalid'
+
+
+def get_origin(url):
+    parts = urlsplit(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def scrape_fixture(client):
+    """
+    The walk through a hall's menus that fixtures record: the day on screen and the next one.
+    :return: the text of the hall's header, and the days scraped.
+    """
+    client.connect()
+    hall_name = client.get_header_text()
+    days = []
+    client.scrape_right(days.append, until=client.get_date().date() + datetime.timedelta(days=1))
+    return hall_name, days
+
+
+class RecordingSession(requests.Session):
+    def __init__(self, origin):
+        super().__init__()
+        self.origin = origin
+        self.exchanges = []
+
+    def request(self, method, url, data=None, **kwargs):
+        response = super().request(method, url, data=data, **kwargs)
+        path = urlsplit(url).path
+        exchange = {
+            'method': method,
+            'path': path,
+        }
+        if path.endswith('/UIDL/'):
+            exchange['rpc'] = json.loads(data)['rpc']
+        exchange.update({
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type'),
+            'body': response.text.replace(self.origin, ORIGIN),
+        })
+        self.exchanges.append(exchange)
+        return response
+
+
+def record(url, path):
+    session = RecordingSession(get_origin(url))
+    client = JamixClient(url, nutrition_cache=NutritionCache(), session=session)
+    try:
+        scrape_fixture(client)
+    finally:
+        client.close()
+    with open(path, 'w') as f:
+        json.dump({
+            'url': url.replace(get_origin(url), ORIGIN),
+            'exchanges': session.exchanges,
+        }, f, indent=1)
+
+
+def load_fixture(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class StandIn:
+    """
+    Local server replaying a recorded fixture, for use as a context manager.
+    Requests differing from the recorded ones get a 500, and are listed in errors.
+    """
+    def __init__(self, fixture):
+        self.fixture = fixture
+        self.exchanges = fixture['exchanges']
+        self.position = 0
+        self.errors = []
+        self.server = None
+        self.origin = None
+
+    @property
+    def url(self):
+        return self.fixture['url'].replace(ORIGIN, self.origin)
+
+    @property
+    def finished(self):
+        return self.position == len(self.exchanges)
+
+    def check(self, request, expected):
+        if expected is None:
+            return 'Unexpected %s %s after the end of the recording.' % (request.method, request.path)
+        if (request.method, request.path) != (expected['method'], expected['path']):
+            return 'Expected %s %s, got %s %s.' % (expected['method'], expected['path'], request.method, request.path)
+        if 'rpc' in expected:
+            rpc = json.loads(request.get_data())['rpc']
+            if rpc != expected['rpc']:
+                return 'Expected RPC %s, got %s.' % (expected['rpc'], rpc)
+        return None
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        expected = self.exchanges[self.position] if self.position < len(self.exchanges) else None
+        error = self.check(request, expected)
+        if error is not None:
+            self.errors.append(error)
+            return Response(error, status=500)(environ, start_response)
+        self.position += 1
+        response = Response(expected['body'].replace(ORIGIN, self.origin),
+                            status=expected['status'],
+                            content_type=expected['content_type'])
+        return response(environ, start_response)
+
+    def __enter__(self):
+        self.server = make_server('127.0.0.1', 0, self)
+        self.origin = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    record(sys.argv[1], sys.argv[2])
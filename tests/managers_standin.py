@@ -0,0 +1,71 @@
+"""
+Serve halls' pages listing their managers from a local stand-in for the dining site, pointed to by MANAGERS_URL.
+
+Pages carry an ETag and Last-Modified date, and conditional requests for a page that hasn't changed get a 304,
+the way the site answers the scraper's revalidation.
+"""
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+import datetime
+import threading
+
+
+def render_page(managers):
+    """
+    :return: a hall's page listing the given names, emails and positions the way the site does.
+    """
+    items = ''.join('<li><a href="mailto:%s">%s</a>, %s</li>' % (email, name, position)
+                    for name, email, position in managers)
+    return '<html><body><h2>Management Team</h2><ul>%s</ul></body></html>' % items
+
+
+class StandIn:
+    """
+    Local server of halls' pages, for use as a context manager.
+    Each response is listed in responses as the slug requested and the status answered with.
+    """
+    def __init__(self):
+        self.pages = {}
+        self.responses = []
+        self.server = None
+        self.origin = None
+
+    @property
+    def url(self):
+        return self.origin + '/residential-dining/'
+
+    def set_page(self, slug, managers):
+        """
+        Publish a hall's page, as a new version if it was already up.
+        """
+        version = self.pages[slug]['version'] + 1 if slug in self.pages else 1
+        self.pages[slug] = {
+            'version': version,
+            'body': render_page(managers),
+            'modified': datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=version),
+        }
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        slug = request.path[len('/residential-dining/'):]
+        page = self.pages.get(slug)
+        if page is None:
+            response = Response('Not found', status=404)
+        else:
+            response = Response(page['body'], content_type='text/html; charset=utf-8')
+            response.set_etag('%s-%d' % (slug, page['version']))
+            response.last_modified = page['modified']
+            response.make_conditional(request)
+        self.responses.append((slug, response.status_code))
+        return response(environ, start_response)
+
+    def __enter__(self):
+        self.server = make_server('127.0.0.1', 0, self)
+        self.origin = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,99 @@
+from flask import make_response
+
+from app import api, cache, db, generations
+from app.models import Hall
+
+import fakeredis
+import json
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def redis(app, monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(cache, 'redis', redis)
+    monkeypatch.setattr(generations, 'redis', redis)
+    return redis
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """
+    Count the halls views rendered, which the cache is there to avoid.
+    """
+    renders = []
+    to_json = api.to_json
+    monkeypatch.setattr(api, 'to_json', lambda *args: renders.append(args) or to_json(*args))
+    return renders
+
+
+@pytest.fixture
+def hall(app):
+    hall = Hall(id='BK', name='Berkeley', nickname='Berkeley', open=True, occupancy=0,
+                latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000')
+    db.session.add(hall)
+    db.session.commit()
+    return hall
+
+
+def get_nicknames(response):
+    return [hall['nickname'] for hall in json.loads(response.get_data())]
+
+
+def get_key(app, path, family):
+    with app.test_request_context(path):
+        return cache.cache_key(family)
+
+
+def test_hits_are_served_from_cache(client, redis, renders, hall):
+    assert get_nicknames(client.get('/halls')) == ['Berkeley']
+    # Changed without a new generation, so the stored response is still the one served
+    hall.nickname = 'Berk'
+    db.session.commit()
+    assert get_nicknames(client.get('/halls')) == ['Berkeley']
+    # Including under the other prefix
+    assert get_nicknames(client.get('/api/halls')) == ['Berkeley']
+    assert len(renders) == 1
+
+
+def test_bump_generation_invalidates(app, client, redis, renders, hall):
+    client.get('/halls')
+    hall.nickname = 'Berk'
+    db.session.commit()
+    generations.bump_generation('halls')
+    assert get_nicknames(client.get('/halls')) == ['Berk']
+    assert len(renders) == 2
+    # Only entries under the current generation are left
+    assert redis.smembers(generations.CACHE_KEYS_FMT % 'halls') == {get_key(app, '/halls', 'halls').encode()}
+
+
+def test_fill_is_single_flight(app, client, redis, renders, hall):
+    key = get_key(app, '/halls', 'halls')
+    # Another worker is filling the same entry
+    redis.set(key + ':lock', b'other', ex=cache.FILL_TIMEOUT)
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(client.get('/halls')))
+    thread.start()
+    time.sleep(10 * cache.FILL_POLL_INTERVAL)
+    assert thread.is_alive()
+    with app.test_request_context('/halls'):
+        redis.hset(key, mapping=cache.to_entry(make_response('[{"nickname": "Filled"}]')))
+    thread.join(cache.FILL_TIMEOUT)
+    assert get_nicknames(responses[0]) == ['Filled']
+    assert renders == []
+
+
+def test_fill_keeps_lock_taken_over_by_another_worker(app, redis):
+    key = 'cache:halls:0:api.api_halls:?'
+
+    def render():
+        # Outlived FILL_TIMEOUT, and another worker took the lock in the meantime
+        redis.set(key + ':lock', b'other', ex=cache.FILL_TIMEOUT)
+        return '[]'
+
+    with app.test_request_context('/halls'):
+        cache.fill(key, 'halls', 60, render)
+    assert redis.get(key + ':lock') == b'other'
+    assert redis.hgetall(key)
@@ -0,0 +1,18 @@
+from app.compression import ENCODINGS, negotiate
+
+import pytest
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, br', ENCODINGS[0]),
+    ('*', ENCODINGS[0]),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br, gzip;q=0.5', ENCODINGS[0]),
+    ('gzip;q=0, br;q=0', None),
+])
+def test_negotiate(app, accept_encoding, expected):
+    with app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+        assert negotiate() == expected
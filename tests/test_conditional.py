@@ -0,0 +1,75 @@
+from redis import Redis
+
+from app import db, generations, redis
+from app.models import Hall, Menu
+from app.util import TIMEZONE, date_to_string
+
+import datetime
+import pytest
+import socket
+import time
+
+# Before the menus fixture stands in for it
+get_generation = generations.get_generation
+MODIFIED = datetime.datetime(2020, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def menus(app, monkeypatch):
+    monkeypatch.setattr(generations, 'get_generation', lambda family: (7, MODIFIED))
+    today = datetime.datetime.now(TIMEZONE).date()
+    db.session.add(Hall(id='BK', name='Berkeley', nickname='Berkeley', open=True, occupancy=0,
+                        latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000'))
+    db.session.add(Menu(hall_id='BK', date=today, body=b'[]'))
+    db.session.add(Menu(hall_id='BK', date=datetime.date(2020, 1, 1), body=b'[]'))
+    db.session.commit()
+    return today
+
+
+def test_implicit_menu_date_is_in_validators(client, menus):
+    response = client.get('/halls/BK/menu')
+    assert response.status_code == 200
+    assert response.get_etag() == ('meals-7-' + date_to_string(menus), True)
+    # Last-Modified is no earlier than the start of the day served
+    day_start = TIMEZONE.localize(datetime.datetime.combine(menus, datetime.time()))
+    assert response.last_modified >= max(MODIFIED, day_start)
+
+
+def test_implicit_menu_date_not_revalidated_on_another_day(client, menus):
+    # What was served under the same generation on an earlier day
+    response = client.get('/halls/BK/menu', headers={'If-None-Match': 'W/"meals-7-2020-01-01"'})
+    assert response.status_code == 200
+    response = client.get('/halls/BK/menu', headers={'If-Modified-Since': 'Wed, 01 Jan 2020 12:00:00 GMT'})
+    assert response.status_code == 200
+
+
+def test_explicit_menu_date_revalidated(client, menus):
+    response = client.get('/halls/BK/menu?date=2020-01-01')
+    assert response.get_etag() == ('meals-7', True)
+    response = client.get('/halls/BK/menu?date=2020-01-01', headers={'If-None-Match': 'W/"meals-7"'})
+    assert response.status_code == 304
+
+
+def test_stalled_redis_falls_back_to_database(client, menus, monkeypatch):
+    # Accepts connections, through the backlog, but never answers a command
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(8)
+    kwargs = redis.connection_pool.connection_kwargs
+    stalled = Redis(host='127.0.0.1', port=server.getsockname()[1],
+                    socket_connect_timeout=kwargs['socket_connect_timeout'],
+                    socket_timeout=kwargs['socket_timeout'],
+                    retry=kwargs['retry'])
+    monkeypatch.setattr(generations, 'get_generation', get_generation)
+    monkeypatch.setattr(generations, 'redis', stalled)
+    try:
+        start = time.monotonic()
+        response = client.get('/halls/BK/menu')
+        elapsed = time.monotonic() - start
+    finally:
+        stalled.close()
+        server.close()
+    assert response.status_code == 200
+    assert response.get_etag() == (None, None)
+    # One timeout for the generation read, not one per retry
+    assert elapsed < kwargs['socket_timeout'] * 2
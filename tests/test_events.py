@@ -0,0 +1,23 @@
+from app import events
+
+import queue
+
+
+def test_changes_fan_out_to_every_stream():
+    hub = events.HallChangeHub()
+    streams = [queue.Queue(maxsize=events.STREAM_QUEUE_SIZE) for i in range(3)]
+    hub.queues.update(streams)
+    hub.publish(b'{"id": "BK"}')
+    assert [changes.get_nowait() for changes in streams] == [b'{"id": "BK"}'] * 3
+
+
+def test_streams_falling_behind_are_ended(monkeypatch):
+    monkeypatch.setattr(events, 'hub', events.HallChangeHub())
+    slow = queue.Queue(maxsize=2)
+    events.hub.queues.add(slow)
+    for i in range(3):
+        events.hub.publish(b'{}')
+    assert slow not in events.hub.queues
+    # Its pending changes are dropped and it ends, so the client reconnects and reads every hall again
+    body = list(events.stream_hall_changes(slow, b'[]'))
+    assert body == ['retry: %d\n\n' % events.RETRY_INTERVAL, 'event: halls\ndata: []\n\n']
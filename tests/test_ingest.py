@@ -0,0 +1,157 @@
+from app import db, scraper
+from app.jamix import DATE_FMT_JAMIX, MenuCache
+from app.models import Hall, Item, Meal, Menu, meals_x_items
+from app.util import TIMEZONE
+
+import datetime
+import json
+import pytest
+
+
+def make_hall(hall_id, name):
+    return Hall(id=hall_id, name=name, nickname=name, open=False, occupancy=0,
+                latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000')
+
+
+def make_day(date, allergens=None):
+    """
+    :return: a scraped day of two meals, serving the same two items.
+    """
+    course = {
+        'name': 'Entree',
+        'ingredients': {
+            'Pesto Pasta': {'diets': 'V', 'ingredients': 'pasta, basil, pine nuts', 'allergens': allergens},
+            'Garden Salad': {'diets': 'VG, GF', 'ingredients': 'lettuce, tomato'},
+        },
+        'nutrition': {
+            'items': {
+                'Pesto Pasta': {'Serving Size': '1 cup', 'Calories': {'amount': 320.0}},
+            },
+        },
+    }
+    return {
+        'date': date.strftime(DATE_FMT_JAMIX),
+        'meals': [{'name': name, 'courses': [course]} for name in ('Lunch', 'Dinner')],
+    }
+
+
+@pytest.fixture
+def menu_cache(app, tmp_path, monkeypatch):
+    menu_cache = MenuCache(str(tmp_path))
+    monkeypatch.setattr(scraper, 'menu_cache', menu_cache)
+    return menu_cache
+
+
+@pytest.fixture
+def bumps(monkeypatch):
+    """
+    Families bumped by the scraper, along with the stored menus at the time.
+    """
+    bumps = []
+
+    def bump_generation(*families):
+        bumps.append((families, {(menu.hall_id, menu.date): json.loads(menu.body) for menu in Menu.query}))
+
+    monkeypatch.setattr(scraper, 'bump_generation', bump_generation)
+    return bumps
+
+
+@pytest.fixture
+def bulk_inserts(monkeypatch):
+    """
+    Tables bulk inserted into by the scraper, and the number of rows each time.
+    """
+    bulk_inserts = []
+    bulk_insert = scraper.bulk_insert
+
+    def record(table, rows):
+        bulk_inserts.append((table.name, len(rows)))
+        bulk_insert(table, rows)
+
+    monkeypatch.setattr(scraper, 'bulk_insert', record)
+    return bulk_inserts
+
+
+def ingest(menu_cache, hall_names, days):
+    for day in days:
+        menu_cache.save_day(hall_names[0], day)
+    return scraper.parse_hall(hall_names, scraper.get_item_index())
+
+
+def test_corrected_allergens_rematerialize_menus(menu_cache, bumps):
+    db.session.add(make_hall('BK', 'Berkeley'))
+    db.session.commit()
+    today = datetime.datetime.now(TIMEZONE).date()
+    ingest(menu_cache, ['Berkeley'], [make_day(today)])
+    bumps.clear()
+
+    # Scraped again, now with the tree nut allergen that used to be missing
+    stats = ingest(menu_cache, ['Berkeley'], [make_day(today, allergens='Tree_Nut')])['Berkeley']
+
+    assert Item.query.filter_by(name='Pesto Pasta').one().tree_nut
+    assert stats['materialized_days'] == 1
+    # The generation is only bumped once the stored menu has been rewritten
+    assert len(bumps) == 1
+    families, menus = bumps[0]
+    assert families == ('meals', 'items')
+    pasta = [item for meal in menus['BK', today]['meals'] for item in meal['items'] if item['name'] == 'Pesto Pasta']
+    assert [item['tree_nut'] for item in pasta] == [True, True]
+
+
+def test_items_deduplicated_by_fingerprint(menu_cache, bumps):
+    db.session.add(make_hall('BK', 'Berkeley'))
+    db.session.commit()
+    today = datetime.datetime.now(TIMEZONE).date()
+    # Both meals serve the same items, which are only inserted once
+    stats = ingest(menu_cache, ['Berkeley'], [make_day(today)])['Berkeley']
+    assert stats['found']['items'] == 4
+    assert stats['inserted']['items'] == 2
+    assert Item.query.count() == 2
+
+    # Scraped again unchanged, so every item is found in the index
+    stats = ingest(menu_cache, ['Berkeley'], [make_day(today)])['Berkeley']
+    assert stats['found']['items'] == 4
+    assert stats['inserted']['items'] == 0
+    assert Item.query.count() == 2
+
+
+def test_identical_rescrape_writes_nothing(menu_cache, bumps, bulk_inserts, writes):
+    db.session.add(make_hall('BK', 'Berkeley'))
+    db.session.commit()
+    today = datetime.datetime.now(TIMEZONE).date()
+    ingest(menu_cache, ['Berkeley'], [make_day(today)])
+    # Items, their nutrition facts, meals and their items each go in with one bulk insert
+    assert sorted(bulk_inserts) == [('items', 2), ('meals', 2), ('meals_x_items', 4), ('nutrition', 1)]
+    del bumps[:], bulk_inserts[:], writes[:]
+
+    # Scraped again unchanged, within the re-verification horizon, so every meal is checked but none rewritten
+    stats = ingest(menu_cache, ['Berkeley'], [make_day(today)])['Berkeley']
+    assert stats['inserted'] == {'meals': 0, 'items': 0}
+    assert stats['updated'] == {'meals': 0}
+    assert all(rows == 0 for table, rows in bulk_inserts)
+    assert writes == []
+    assert bumps == []
+    assert Meal.query.count() == 2
+    assert db.session.query(meals_x_items).count() == 4
+
+
+def test_shared_menu_ingested_into_every_hall(menu_cache, bumps):
+    db.session.add(make_hall('BK', 'Berkeley'))
+    db.session.add(make_hall('BR', 'Branford'))
+    db.session.commit()
+    today = datetime.datetime.now(TIMEZONE).date()
+    stats = ingest(menu_cache, ['Berkeley', 'Branford'], [make_day(today)])
+
+    for hall_id, hall_name in (('BK', 'Berkeley'), ('BR', 'Branford')):
+        assert sorted(meal.name for meal in Meal.query.filter_by(hall_id=hall_id)) == ['Dinner', 'Lunch']
+        assert stats[hall_name]['inserted']['meals'] == 2
+        assert stats[hall_name]['materialized_days'] == 1
+    # Parsed once, so the items are shared rather than inserted for each hall
+    assert stats['Berkeley']['found'] == stats['Branford']['found'] == {'days': 1, 'meals': 2, 'items': 4}
+    assert Item.query.count() == 2
+    assert db.session.query(meals_x_items).count() == 8
+    # Each hall's stored menu lists its own meals, of the same items
+    families, menus = bumps[-1]
+    served = {hall_id: [(meal['name'], [item['id'] for item in meal['items']]) for meal in menus[hall_id, today]['meals']]
+              for hall_id in ('BK', 'BR')}
+    assert served['BK'] == served['BR']
@@ -0,0 +1,93 @@
+from tests.jamix_standin import StandIn, load_fixture, scrape_fixture
+
+from app import db, scraper
+from app.jamix import DATE_FMT_JAMIX, JamixClient, MenuCache, NutritionCache
+from app.models import Hall, Meal, Item, Nutrition, Menu
+
+import datetime
+import os
+import pytest
+import requests
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'jamix', 'hall.json')
+
+
+@pytest.fixture
+def standin():
+    with StandIn(load_fixture(FIXTURE)) as standin:
+        yield standin
+
+
+@pytest.fixture
+def scraped(standin):
+    client = JamixClient(standin.url, nutrition_cache=NutritionCache())
+    try:
+        hall_name, days = scrape_fixture(client)
+    finally:
+        client.close()
+    assert standin.errors == []
+    assert standin.finished
+    return hall_name, days
+
+
+def test_replay_scrapes_days(scraped):
+    hall_name, days = scraped
+    assert scraper.clean_hall_name(hall_name) == 'Berkeley'
+    # The second day has no menu, which ends the scrape
+    assert len(days) == 1
+    day = days[0]
+    datetime.datetime.strptime(day['date'], DATE_FMT_JAMIX)
+    assert [meal['name'] for meal in day['meals']] == ['Breakfast', 'Lunch']
+    for meal in day['meals']:
+        for course in meal['courses']:
+            assert course['ingredients']
+            assert set(course['nutrition']['items']) == set(course['ingredients'])
+            for ingredients in course['ingredients'].values():
+                assert {'diets', 'ingredients'} <= set(ingredients)
+    breakfast = day['meals'][0]['courses'][0]
+    assert breakfast['name'] == 'Hot Breakfast'
+    assert breakfast['ingredients']['Scrambled Eggs'] == {
+        'diets': 'V, GF',
+        'ingredients': 'Liquid whole eggs, butter, salt',
+        'allergens': 'Egg, Dairy',
+    }
+    eggs = breakfast['nutrition']['items']['Scrambled Eggs']
+    assert eggs['Serving Size'] == '1 serving'
+    assert eggs['Calories'] == {'amount': 182.0}
+    assert eggs['Total Fat'] == {'amount': '13.4 g', 'percent_daily_value': 17}
+    # Course names are overridden as they're read
+    assert day['meals'][1]['courses'][0]['name'] == 'Dessert'
+
+
+def test_replayed_days_are_ingested(app, scraped, tmp_path, monkeypatch):
+    hall_name, days = scraped
+    hall_name = scraper.clean_hall_name(hall_name)
+    db.session.add(Hall(id='BK', name=hall_name, nickname=hall_name, open=False, occupancy=0,
+                        latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000'))
+    db.session.commit()
+    menu_cache = MenuCache(str(tmp_path))
+    for day in days:
+        menu_cache.save_day(hall_name, day)
+    monkeypatch.setattr(scraper, 'menu_cache', menu_cache)
+
+    stats = scraper.parse_hall([hall_name], scraper.get_item_index())[hall_name]
+
+    # Oatmeal is served in two courses, which makes it two items
+    assert stats['inserted'] == {'meals': 2, 'items': 4}
+    assert stats['materialized_days'] == 1
+    assert [meal.name for meal in Meal.query.order_by(Meal.start_time)] == ['Breakfast', 'Lunch']
+    assert Item.query.count() == 4
+    eggs = Item.query.filter_by(name='Scrambled Eggs').one()
+    assert (eggs.egg, eggs.dairy, eggs.meat, eggs.gluten) == (True, True, False, False)
+    nutrition = Nutrition.query.get(eggs.id)
+    assert (nutrition.calories, nutrition.total_fat, nutrition.total_fat_pdv) == (180, '13 g', 17)
+    assert Menu.query.count() == 1
+
+
+def test_standin_rejects_unrecorded_requests(standin):
+    client = JamixClient(standin.url, nutrition_cache=NutritionCache())
+    client.connect()
+    # The recording selects the first meal's tab next, not the next day
+    with pytest.raises(requests.HTTPError):
+        client.click_next_date()
+    assert len(standin.errors) == 1
@@ -0,0 +1,60 @@
+from app import db, scraper
+from app.models import Manager
+from tests.managers_standin import StandIn
+from tests.test_ingest import make_hall
+
+import pytest
+
+BERKELEY = [('Ann Lee', 'ann.lee@yale.edu', 'General Manager'),
+            ('Bo Park', 'bo.park@yale.edu', 'Executive Chef')]
+BRANFORD = [('Cy Diaz', 'cy.diaz@yale.edu', 'General Manager')]
+
+
+@pytest.fixture
+def standin(app, tmp_path, monkeypatch):
+    db.session.add(make_hall('BK', 'Berkeley'))
+    db.session.add(make_hall('BR', 'Branford'))
+    db.session.commit()
+    monkeypatch.setattr(scraper, 'MANAGER_PAGES_FILE', str(tmp_path / 'manager_pages.json'))
+    with StandIn() as standin:
+        monkeypatch.setitem(app.config, 'MANAGERS_URL', standin.url)
+        standin.set_page('berkeley', BERKELEY)
+        standin.set_page('branford', BRANFORD)
+        yield standin
+
+
+@pytest.fixture
+def bumps(monkeypatch):
+    bumps = []
+    monkeypatch.setattr(scraper, 'bump_generation', lambda *families: bumps.append(families))
+    return bumps
+
+
+def get_managers(hall_id):
+    return Manager.query.filter_by(hall_id=hall_id).order_by(Manager.id).all()
+
+
+def test_unchanged_pages_write_nothing(standin, bumps, writes):
+    scraper.scrape_managers()
+    assert [(manager.name, manager.email, manager.position) for manager in get_managers('BK')] == BERKELEY
+    assert bumps == [('managers',)]
+    del bumps[:], writes[:], standin.responses[:]
+
+    scraper.scrape_managers()
+    assert sorted(standin.responses) == [('berkeley', 304), ('branford', 304)]
+    assert writes == []
+    assert bumps == []
+
+
+def test_changed_page_replaces_only_its_hall(standin, bumps):
+    scraper.scrape_managers()
+    berkeley_ids = [manager.id for manager in get_managers('BK')]
+    del bumps[:], standin.responses[:]
+
+    branford = [('Dee Wu', 'dee.wu@yale.edu', 'General Manager')]
+    standin.set_page('branford', branford)
+    scraper.scrape_managers()
+    assert sorted(standin.responses) == [('berkeley', 304), ('branford', 200)]
+    assert [(manager.name, manager.email, manager.position) for manager in get_managers('BR')] == branford
+    assert [manager.id for manager in get_managers('BK')] == berkeley_ids
+    assert bumps == [('managers',)]
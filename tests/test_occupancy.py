@@ -0,0 +1,22 @@
+from app import db
+from app.models import Hall
+
+import pytest
+
+
+@pytest.fixture
+def hall(app):
+    db.session.add(Hall(id='BK', name='Berkeley', nickname='Berkeley', open=True, occupancy=3,
+                        latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000'))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('url, status', [
+    ('/halls/BK/occupancy?resolution=raw&start=2026-01-01&end=2026-01-07', 200),
+    ('/halls/BK/occupancy?resolution=raw&start=2026-01-01&end=2026-01-08', 400),
+    ('/halls/BK/occupancy?resolution=hour&start=2026-01-01&end=2026-03-31', 200),
+    ('/halls/BK/occupancy?resolution=day&start=2024-01-01&end=2026-01-01', 400),
+    ('/halls/XX/occupancy', 404),
+])
+def test_occupancy_span_is_capped(client, hall, url, status):
+    assert client.get(url).status_code == status
@@ -0,0 +1,24 @@
+from app import db
+from app.models import Item
+
+import json
+import re
+
+
+def test_pages_link_relatively_to_the_next(app, client):
+    db.session.add_all([Item(name='Item %d' % i) for i in range(5)])
+    db.session.commit()
+    names = []
+    url = '/api/items?limit=2'
+    while url is not None:
+        response = client.get(url, base_url='https://api.yaledine.com')
+        names += [item['name'] for item in json.loads(response.get_data())]
+        link = re.match(r'<([^>]+)>; rel="next"', response.headers.get('Link', ''))
+        url = link.group(1) if link else None
+        if url is not None:
+            assert url.startswith('/api/items?')
+    assert names == ['Item %d' % i for i in range(5)]
+
+
+def test_malformed_cursor_is_rejected(client):
+    assert client.get('/items?cursor=WyJ4Il0').status_code == 400
@@ -0,0 +1,80 @@
+from sqlalchemy import event
+
+from app import db
+from app.models import Hall, Manager, Meal, Item, Nutrition, Menu, meals_x_items
+
+import datetime
+import pytest
+
+DATE = datetime.date(2026, 1, 1)
+# Most queries each endpoint may issue, with its whole body read
+QUERY_BUDGETS = {
+    '/halls': 1,
+    '/halls/BK': 1,
+    '/halls/BK/managers': 2,
+    '/halls/BK/meals': 2,
+    '/halls/BK/meals?limit=2': 2,
+    '/halls/BK/menu?date=2026-01-01': 1,
+    '/halls/BK/occupancy?resolution=hour': 2,
+    '/managers': 1,
+    '/managers?limit=2': 1,
+    '/meals': 1,
+    '/meals?date=2026-01-01': 1,
+    '/meals?limit=2': 1,
+    '/meals/1': 1,
+    '/meals/1/items': 2,
+    '/items': 1,
+    '/items?limit=2': 1,
+    '/items/1': 1,
+    '/items/1/nutrition': 2,
+}
+
+
+@pytest.fixture
+def seeded(app):
+    db.session.add(Hall(id='BK', name='Berkeley', nickname='Berkeley', open=True, occupancy=3,
+                        latitude=41.3, longitude=-72.9, address='205 Elm St', phone='203-432-0000'))
+    for i in range(5):
+        db.session.add(Manager(name='Manager %d' % i, hall_id='BK'))
+        db.session.add(Item(name='Item %d' % i, nutrition=Nutrition(calories=100)))
+    for i, name in enumerate(('Breakfast', 'Lunch', 'Dinner')):
+        db.session.add(Meal(name=name, date=DATE, start_time='%02d:00' % (8 + 4 * i), hall_id='BK'))
+    db.session.add(Menu(hall_id='BK', date=DATE, body=b'[]'))
+    db.session.flush()
+    db.session.execute(meals_x_items.insert(), [
+        {'meal_id': meal_id, 'item_id': item_id}
+        for meal_id in range(1, 4)
+        for item_id in range(1, 6)
+    ])
+    db.session.commit()
+    db.session.remove()
+
+
+def count_queries(client, url):
+    count = 0
+
+    def on_execute(*args):
+        nonlocal count
+        count += 1
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    try:
+        response = client.get(url)
+        # Streamed bodies are only queried for as they're read
+        response.get_data()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+    assert response.status_code == 200, url
+    return count
+
+
+@pytest.mark.parametrize('url', QUERY_BUDGETS)
+def test_query_budget(client, seeded, url):
+    assert count_queries(client, url) <= QUERY_BUDGETS[url]
+
+
+def test_streamed_meals_are_counted(app, client, seeded, monkeypatch):
+    # The budget check runs once the stream has been read, so it sees the queries issued while streaming
+    monkeypatch.setitem(app.config, 'MAX_QUERIES_PER_REQUEST', 0)
+    with pytest.raises(AssertionError):
+        client.get('/meals').get_data()
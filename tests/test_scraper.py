@@ -0,0 +1,93 @@
+from app import scraper
+from app.models import Hall
+from app.jamix import JamixError, NutritionCache
+
+import copy
+import pytest
+
+
+class FailingClient:
+    """
+    Client of a JAMIX app that's down.
+    """
+    connects = 0
+
+    def __init__(self):
+        self.recoveries = 0
+        self.refreshes = 0
+        self.nutrition_hits = 0
+        self.rpcs = {}
+        self.waits = {}
+
+    def connect(self):
+        FailingClient.connects += 1
+        raise JamixError('JAMIX is down')
+
+    def close(self):
+        pass
+
+
+def test_parse_gives_up_after_max_restarts(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JAMIX_MAX_RESTARTS', 2)
+    monkeypatch.setitem(app.config, 'JAMIX_RESTART_DELAY', 0)
+    monkeypatch.setattr(scraper, 'create_client', lambda hall_jamix_id: FailingClient())
+    monkeypatch.setattr(scraper, 'nutrition_cache', NutritionCache())
+    FailingClient.connects = 0
+    with pytest.raises(JamixError):
+        scraper.parse(1)
+    assert FailingClient.connects == 3
+
+
+class FastTrackResponse:
+    """
+    Response of the FastTrack API listing the given halls' rows.
+    """
+    COLUMNS = ['ID_LOCATION', 'LOCATIONCODE', 'DININGLOCATIONNAME', 'TYPE', 'CAPACITY', 'ISCLOSED',
+               'ADDRESS', 'PHONE', 'GEOLOCATION']
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def json(self):
+        return {
+            'COLUMNS': self.COLUMNS,
+            'DATA': [[row[column] for column in self.COLUMNS] for row in self.rows],
+        }
+
+
+FASTTRACK_ROWS = [
+    {'ID_LOCATION': 1, 'LOCATIONCODE': 1, 'DININGLOCATIONNAME': 'Berkeley', 'TYPE': 'Residential',
+     'CAPACITY': 4, 'ISCLOSED': 0, 'ADDRESS': '205 Elm St', 'PHONE': '203-432-0000', 'GEOLOCATION': '41.3,-72.9'},
+    {'ID_LOCATION': 2, 'LOCATIONCODE': 2, 'DININGLOCATIONNAME': 'Branford', 'TYPE': 'Residential',
+     'CAPACITY': 6, 'ISCLOSED': 0, 'ADDRESS': '74 High St', 'PHONE': '203-432-0001', 'GEOLOCATION': '41.3,-72.9'},
+]
+
+
+def test_unchanged_fasttrack_poll_writes_no_halls(app, monkeypatch, writes):
+    rows = copy.deepcopy(FASTTRACK_ROWS)
+    monkeypatch.setattr(scraper.requests, 'get', lambda *args, **kwargs: FastTrackResponse(rows))
+    monkeypatch.setattr(scraper, 'fasttrack_state', {})
+    bumps = []
+    monkeypatch.setattr(scraper, 'bump_generation', lambda *families: bumps.append(families))
+    published = []
+    monkeypatch.setattr(scraper, 'publish_hall_changes', published.append)
+
+    scraper.scrape_fasttrack()
+    assert sorted(hall.id for hall in Hall.query) == ['BK', 'BR']
+    assert bumps == [('halls',), ('occupancy',)]
+    del writes[:], bumps[:], published[:]
+
+    # Unchanged, so only the occupancy history is written to
+    scraper.scrape_fasttrack()
+    assert not [statement for statement in writes if 'halls' in statement]
+    assert bumps == [('occupancy',)]
+    assert published == []
+    del writes[:], bumps[:], published[:]
+
+    # Only the hall that changed is written, and announced
+    rows[1]['CAPACITY'] = 7
+    scraper.scrape_fasttrack()
+    assert len([statement for statement in writes if 'halls' in statement]) == 1
+    assert Hall.query.get('BR').occupancy == 7
+    assert bumps == [('halls',), ('occupancy',)]
+    assert [[hall['id'] for hall in halls] for halls in published] == [['BR']]